@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""
+benchmark of closing a zip file made by zipx, which writes
+the central directory.  the members are registered without any data
+so that only the time of ZipFileImproved.close() is measured.
+"""
+
+import sys
+from os import path as ospath
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from argparse import ArgumentParser
+from argparse import ArgumentDefaultsHelpFormatter
+
+sys.path.insert(0, ospath.dirname(ospath.dirname(ospath.abspath(__file__))))
+import zipx
+
+ap = ArgumentParser(
+        description="benchmark of closing a zip file made by zipx.",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+ap.add_argument("-N", action="store", dest="nb_entries", type=int,
+                default=1000000, help="specify the number of the entries.")
+ap.add_argument("-e", "--encoding", action="store", dest="filename_encoding",
+                default="cp932",
+                help="specify a filename encoding.  e.g. cp932, utf-8.")
+ap.add_argument("-v", action="store_true", dest="verbose",
+                help="print the progress while closing.")
+opt = ap.parse_args()
+
+with TemporaryDirectory() as tmpdir:
+    z = zipx.ZipFileImproved(ospath.join(tmpdir, "close.zip"), "w",
+                             verbose=opt.verbose)
+    z.filename_encoding = opt.filename_encoding
+    z.unicode_normalize = None
+    for i in range(opt.nb_entries):
+        zi = z.zipinfo_cls(f"フォルダ{i//1000}/ファイル{i}.txt")
+        zi.header_offset = 0
+        zi.compress_size = zi.file_size = zi.CRC = 0
+        z.filelist.append(zi)
+    z._didModify = True
+    t0 = perf_counter()
+    z.close()
+    elapsed = perf_counter() - t0
+    print(f"{opt.nb_entries} entries: {elapsed:.3f} sec, "
+          f"{opt.nb_entries/elapsed:.0f} entries/sec")
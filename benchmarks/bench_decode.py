@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+benchmark of the filename decoding of unzipx.
+it compares the per-entry decoding (decode_filename) with the decoding
+for the whole archive (decode_filenames) against a zip file generated.
+"""
+
+import sys
+import zipfile
+from os import path as ospath
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from argparse import ArgumentParser
+from argparse import ArgumentDefaultsHelpFormatter
+
+sys.path.insert(0, ospath.dirname(ospath.dirname(ospath.abspath(__file__))))
+import unzipx
+
+class RawNameInfo(zipfile.ZipInfo):
+    """
+    ZipInfo putting the filename encoded as it is, without the utf-8 bit.
+    """
+    __slots__ = ("raw_encoding",)
+    def _encodeFilenameFlags(self):
+        return self.filename.encode(self.raw_encoding), self.flag_bits
+
+def make_zip_file(zip_file, nb_entries, encoding):
+    with zipfile.ZipFile(zip_file, "w") as z:
+        for i in range(nb_entries):
+            zi = RawNameInfo(f"資料/フォルダ{i//100}/ファイル{i}.txt")
+            zi.raw_encoding = encoding
+            z.writestr(zi, b"")
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = perf_counter()
+        func()
+        elapsed = perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+ap = ArgumentParser(
+        description="benchmark of the filename decoding of unzipx.",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+ap.add_argument("-N", action="store", dest="nb_entries", type=int,
+                default=100000, help="specify the number of the entries.")
+ap.add_argument("-r", action="store", dest="repeat", type=int,
+                default=5, help="specify the number of the repeat.")
+opt = ap.parse_args()
+
+with TemporaryDirectory() as tmpdir:
+    for encoding in ["cp932", "utf-8"]:
+        zip_file = ospath.join(tmpdir, f"{encoding}.zip")
+        make_zip_file(zip_file, opt.nb_entries, encoding)
+        with zipfile.ZipFile(zip_file) as z:
+            infolist = z.infolist()
+        t_entry = measure(lambda: [unzipx.decode_filename(zi, "auto")
+                                   for zi in infolist], opt.repeat)
+        t_batch = measure(lambda: unzipx.decode_filenames(infolist, "auto"),
+                          opt.repeat)
+        names, report = unzipx.decode_filenames(infolist, "auto")
+        assert names == [unzipx.decode_filename(zi, "auto")
+                         for zi in infolist]
+        print(f"{encoding}: {opt.nb_entries} entries, "
+              f"detected {report['encoding']}")
+        print(f"  per-entry: {t_entry:.3f} sec")
+        print(f"  archive  : {t_batch:.3f} sec ({t_entry/t_batch:.1f}x)")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+benchmark of the startup of unzipx.
+it measures the import time reported by "python -X importtime" and
+the wall time of listing a tiny zip file, and checks that the modules
+loaded lazily are not imported.  it exits with 1 if the check fails,
+or the import time exceeds the limit specified.
+"""
+
+import sys
+import zipfile
+import subprocess
+from os import path as ospath
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from argparse import ArgumentParser
+from argparse import ArgumentDefaultsHelpFormatter
+
+top_dir = ospath.dirname(ospath.dirname(ospath.abspath(__file__)))
+unzipx_path = ospath.join(top_dir, "unzipx.py")
+
+# the modules which must not be imported to list a zip file.
+lazy_modules = ["pyzipper", "Cryptodome", "Crypto", "cryptography",
+                "concurrent.futures", "unicodedata", "pickle", "hashlib"]
+
+def import_times(args):
+    """
+    run python with args, and return a dict of the module names and
+    the self import times in micro seconds.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          check=True, text=True, cwd=top_dir)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+def measure(args, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL,
+                       check=True, cwd=top_dir)
+        elapsed = perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def check_lazy(label, times):
+    loaded = [x for x in lazy_modules
+              if any(name == x or name.startswith(x + ".") for name in times)]
+    if loaded:
+        print(f"  NG: {label} imports {', '.join(loaded)}")
+        return False
+    return True
+
+ap = ArgumentParser(
+        description="benchmark of the startup of unzipx.",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+ap.add_argument("-r", action="store", dest="repeat", type=int,
+                default=10, help="specify the number of the repeat.")
+ap.add_argument("-t", action="store", dest="top", type=int,
+                default=10, help="specify the number of the slowest modules.")
+ap.add_argument("--max-ms", action="store", dest="max_ms", type=float,
+                help="specify the limit of the import time in msec.")
+opt = ap.parse_args()
+
+ok = True
+with TemporaryDirectory() as tmpdir:
+    zip_file = ospath.join(tmpdir, "tiny.zip")
+    with zipfile.ZipFile(zip_file, "w") as z:
+        z.writestr("a.txt", b"a")
+    baseline = sum(import_times(["-c", "pass"]).values())
+    for label, args in [
+            ("import unzipx", ["-c", "import unzipx"]),
+            ("unzipx list", [unzipx_path, zip_file])]:
+        # the best of the runs to reduce the noise.
+        runs = [import_times(args) for _ in range(opt.repeat)]
+        times = min(runs, key=lambda x: sum(x.values()))
+        total = (sum(times.values()) - baseline) / 1000
+        wall = measure(args, opt.repeat)
+        print(f"{label}: import {total:.1f} ms over the interpreter, "
+              f"wall {wall*1000:.1f} ms")
+        for name, us in sorted(times.items(), key=lambda x: -x[1])[:opt.top]:
+            print(f"  {us/1000:7.2f} ms {name}")
+        ok &= check_lazy(label, times)
+        if opt.max_ms is not None and total > opt.max_ms:
+            print(f"  NG: {total:.1f} ms exceeds {opt.max_ms} ms")
+            ok = False
+
+sys.exit(0 if ok else 1)
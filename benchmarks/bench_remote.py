@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+benchmark of reading a zip file by HTTP Range requests.
+a local HTTP server supporting the range requests stands in for
+the object storage.  it lists a zip file generated, and extracts a member
+and all members, and reports the number of the requests and the bytes
+fetched against the size of the zip file.  the files extracted are
+compared with the ones in the zip file.
+"""
+
+import sys
+import os
+import re
+import zipfile
+import threading
+from os import path as ospath
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from functools import partial
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from argparse import ArgumentParser
+from argparse import ArgumentDefaultsHelpFormatter
+
+sys.path.insert(0, ospath.dirname(ospath.dirname(ospath.abspath(__file__))))
+import unzipx
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    SimpleHTTPRequestHandler answering "Range: bytes=first-last".
+    the requests and the bytes sent are counted in server.counters.
+    """
+    protocol_version = "HTTP/1.1"
+    re_range = re.compile(r"bytes=(\d+)-(\d*)$")
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        m = self.re_range.match(self.headers.get("Range", ""))
+        if m is None:
+            return super().send_head()
+        path = self.translate_path(self.path)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404)
+            return None
+        size = os.fstat(f.fileno()).st_size
+        first = int(m.group(1))
+        last = min(int(m.group(2)) if m.group(2) else size - 1, size - 1)
+        if first > last:
+            f.close()
+            self.send_error(416)
+            return None
+        f.seek(first)
+        self.send_response(206)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.send_header("Content-Length", str(last - first + 1))
+        self.end_headers()
+        counters = self.server.counters
+        with counters["lock"]:
+            counters["requests"] += 1
+            counters["bytes"] += last - first + 1
+        self.range_length = last - first + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        length = getattr(self, "range_length", None)
+        if length is None:
+            return super().copyfile(source, outputfile)
+        while length > 0:
+            data = source.read(min(length, 1024*1024))
+            if not data:
+                break
+            outputfile.write(data)
+            length -= len(data)
+
+def start_server(directory):
+    server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            partial(RangeRequestHandler, directory=directory))
+    server.counters = {"lock": threading.Lock(), "requests": 0, "bytes": 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_zip_file(zip_file, nb_entries, size):
+    with zipfile.ZipFile(zip_file, "w") as z:
+        for i in range(nb_entries):
+            # half of them are stored, and the others are deflated.
+            compress_type = (zipfile.ZIP_STORED if i % 2 else
+                             zipfile.ZIP_DEFLATED)
+            data = os.urandom(size // 2) + bytes(size - size // 2)
+            z.writestr(f"dir{i % 10}/file{i}.bin", data,
+                       compress_type=compress_type)
+
+def measure(server, func):
+    counters = server.counters
+    counters["requests"] = counters["bytes"] = 0
+    t0 = perf_counter()
+    func()
+    return perf_counter() - t0, counters["requests"], counters["bytes"]
+
+ap = ArgumentParser(
+        description="benchmark of reading a zip file by HTTP Range requests.",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+ap.add_argument("-N", action="store", dest="nb_entries", type=int,
+                default=2000, help="specify the number of the entries.")
+ap.add_argument("-S", action="store", dest="size", type=int,
+                default=64*1024, help="specify the size of each entry.")
+ap.add_argument("-j", "--jobs", action="store", dest="jobs", type=int,
+                default=4, help="specify the number of workers to extract.")
+ap.add_argument("--block-size", action="store", dest="block_size",
+                type=int, default=256, help="specify the block size in KB.")
+opt = ap.parse_args()
+
+with TemporaryDirectory() as tmpdir:
+    zip_file = ospath.join(tmpdir, "remote.zip")
+    make_zip_file(zip_file, opt.nb_entries, opt.size)
+    zip_size = os.stat(zip_file).st_size
+    server = start_server(tmpdir)
+    url = f"http://127.0.0.1:{server.server_port}/remote.zip"
+    print(f"{url}: {zip_size} bytes, {opt.nb_entries} entries")
+    local = zipfile.ZipFile(zip_file)
+
+    def open_archive():
+        source = unzipx.open_url(url, block_size=opt.block_size*1024)
+        return unzipx.Archive(source)
+
+    def list_files():
+        with open_archive() as archive:
+            assert len(list(archive.members())) == opt.nb_entries
+
+    def extract(number, jobs):
+        def run():
+            dest_dir = ospath.join(tmpdir, f"out{number}-{jobs}")
+            with open_archive() as archive:
+                members = [m for m in archive.members(dest_dir=dest_dir)
+                           if number is None or m.number == number]
+                result = archive.extract_members(members, jobs=jobs)
+            assert not result.errors, result.errors
+            for n, path in result.extracted:
+                with open(path, "rb") as fd:
+                    assert fd.read() == local.read(local.infolist()[n - 1])
+        return run
+
+    for label, func in [
+            ("list", list_files),
+            ("extract one", extract(opt.nb_entries // 2, 1)),
+            ("extract all", extract(None, 1)),
+            (f"extract all -j {opt.jobs}", extract(None, opt.jobs))]:
+        elapsed, requests, nbytes = measure(server, func)
+        print(f"{label:16} {elapsed:7.3f} sec {requests:6} requests "
+              f"{nbytes:12} bytes ({nbytes / zip_size * 100:.1f}%)")
+    server.shutdown()
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+
+"""
+benchmark suite of zipx and unzipx.
+it generates synthetic zip files, runs zipx and unzipx against them,
+and reports the wall time, the throughput, and the peak RSS of each
+operation.  the results are written into a JSON file, and can be
+compared with the one saved as a baseline.
+
+    python benchmarks/bench_suite.py -o base.json
+    (change the code)
+    python benchmarks/bench_suite.py -o new.json --baseline base.json
+
+the operations are:
+    create  : zipx zips the files extracted from the zip file by the same
+              compression method, with AES if the case is encrypted.
+    list    : unzipx lists the members.
+    select  : unzipx extracts about 10% of the members.
+    extract : unzipx extracts all members.
+"""
+
+import sys
+import os
+import json
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import zipfile
+import zlib
+from fnmatch import fnmatch
+from os import path as ospath
+from tempfile import TemporaryDirectory
+from time import perf_counter, strftime
+from argparse import ArgumentParser
+from argparse import ArgumentDefaultsHelpFormatter
+
+try:
+    import pyzipper
+except ModuleNotFoundError:
+    pyzipper = None
+
+top_dir = ospath.dirname(ospath.dirname(ospath.abspath(__file__)))
+unzipx_path = ospath.join(top_dir, "unzipx.py")
+zipx_path = ospath.join(top_dir, "zipx.py")
+
+PASSWORD = "benchmark"
+MB = 1024*1024
+
+"""
+the cases of the zip files.
+names is the encoding of the filenames:
+    cp932       : cp932 without the utf-8 bit, made by Windows.
+    utf-8       : utf-8 with the utf-8 bit.
+    utf-8-noflag: utf-8 without the utf-8 bit, made by mac.
+content is "text" (compressible) or "random" (incompressible).
+size is the size of each file in bytes, multiplied by --scale for
+the huge files, and count is multiplied by --scale for the tiny files.
+"""
+cases = [
+    dict(name="tiny-cp932-deflate", count=5000, size=1024, content="text",
+         names="cp932", compression="deflate"),
+    dict(name="tiny-utf8-stored", count=5000, size=1024, content="text",
+         names="utf-8", compression="stored"),
+    dict(name="tiny-utf8noflag-deflate", count=5000, size=1024,
+         content="text", names="utf-8-noflag", compression="deflate"),
+    dict(name="huge-stored", count=2, size=64*MB, content="random",
+         names="cp932", compression="stored"),
+    dict(name="huge-deflate", count=2, size=64*MB, content="text",
+         names="cp932", compression="deflate"),
+    dict(name="huge-lzma", count=1, size=16*MB, content="text",
+         names="utf-8", compression="lzma"),
+    dict(name="zipcrypto-deflate", count=200, size=8*1024, content="text",
+         names="cp932", compression="deflate", encryption="zipcrypto"),
+    dict(name="aes-deflate", count=200, size=64*1024, content="text",
+         names="utf-8", compression="deflate", encryption="aes"),
+    ]
+
+operations = ["create", "list", "select", "extract"]
+
+compressions = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "lzma": zipfile.ZIP_LZMA,
+    }
+
+class RawNameInfo(zipfile.ZipInfo):
+    """
+    ZipInfo putting the filename encoded as it is, without the utf-8 bit.
+    """
+    __slots__ = ("raw_encoding",)
+    def _encodeFilenameFlags(self):
+        return self.filename.encode(self.raw_encoding), self.flag_bits
+
+def is_huge(case):
+    return case["count"] < 10
+
+def member_name(case, i):
+    # the members are spread into 10 directories to select one of them.
+    if is_huge(case):
+        return f"大きいファイル{i}.bin"
+    return f"フォルダ{i % 10}/ファイル{i}.txt"
+
+def make_zipinfo(case, name):
+    if case["names"] == "utf-8":
+        zi = zipfile.ZipInfo(name)
+    else:
+        zi = RawNameInfo(name)
+        zi.raw_encoding = "cp932" if case["names"] == "cp932" else "utf-8"
+    zi.date_time = (2020, 1, 1, 0, 0, 0)
+    zi.compress_type = compressions[case["compression"]]
+    return zi
+
+def make_contents(case, size, rnd):
+    if case["content"] == "random":
+        return rnd.randbytes(size)
+    words = ["zip", "unzip", "ファイル", "archive", "圧縮", "deflate",
+             "member", "名前", "directory", "central"]
+    line = " ".join(rnd.choice(words) for _ in range(16)).encode() + b"\n"
+    # repeat a block not to take long to generate the huge ones.
+    block = b"".join(line[rnd.randrange(len(line)):] + line
+                     for _ in range(64))
+    return (block * (size // len(block) + 1))[:size]
+
+def iter_members(case, scale):
+    rnd = random.Random(case["name"])
+    count = case["count"]
+    size = case["size"]
+    if is_huge(case):
+        size = max(1, int(size * scale))
+    else:
+        count = max(10, int(count * scale))
+    for i in range(count):
+        yield member_name(case, i), make_contents(case, size, rnd)
+
+class ZipCrypto:
+    """
+    the traditional PKWARE encryption.  neither zipfile.py nor pyzipper
+    can write it, so the zip files are made by write_zipcrypto().
+    """
+    table = []
+    for n in range(256):
+        for _ in range(8):
+            n = (n >> 1) ^ 0xEDB88320 if n & 1 else n >> 1
+        table.append(n)
+
+    def __init__(self, password):
+        self.keys = [0x12345678, 0x23456789, 0x34567890]
+        for c in password:
+            self.update(c)
+
+    def crc(self, c, crc):
+        return self.table[(crc ^ c) & 0xff] ^ (crc >> 8)
+
+    def update(self, c):
+        k0, k1, k2 = self.keys
+        k0 = self.crc(c, k0)
+        k1 = ((k1 + (k0 & 0xff)) * 134775813 + 1) & 0xffffffff
+        k2 = self.crc(k1 >> 24, k2)
+        self.keys = [k0, k1, k2]
+
+    def encrypt(self, data):
+        out = bytearray(len(data))
+        for i, c in enumerate(data):
+            t = self.keys[2] | 2
+            out[i] = c ^ (((t * (t ^ 1)) >> 8) & 0xff)
+            self.update(c)
+        return bytes(out)
+
+def write_zipcrypto(zip_file, case, members):
+    central = []
+    with open(zip_file, "wb") as fd:
+        for name, data in members:
+            zi = make_zipinfo(case, name)
+            raw_name, flag_bits = zi._encodeFilenameFlags()
+            flag_bits |= 0x1
+            crc = zlib.crc32(data)
+            if zi.compress_type == zipfile.ZIP_DEFLATED:
+                c = zlib.compressobj(6, zlib.DEFLATED, -15)
+                payload = c.compress(data) + c.flush()
+            else:
+                payload = data
+            enc = ZipCrypto(PASSWORD.encode())
+            header = os.urandom(11) + bytes([crc >> 24])
+            payload = enc.encrypt(header) + enc.encrypt(payload)
+            dostime = zi.date_time[3] << 11
+            dosdate = (zi.date_time[0] - 1980) << 9 | zi.date_time[1] << 5 | \
+                    zi.date_time[2]
+            fields = (20, 0, flag_bits, zi.compress_type, dostime, dosdate,
+                      crc, len(payload), len(data), len(raw_name), 0)
+            central.append((fd.tell(), raw_name, fields))
+            fd.write(struct.pack("<4s2B4HL2L2H", b"PK\003\004", *fields))
+            fd.write(raw_name)
+            fd.write(payload)
+        start_dir = fd.tell()
+        for offset, raw_name, fields in central:
+            fd.write(struct.pack("<4s4B4HL2L5H2L", b"PK\001\002", 20, 0,
+                                 *fields, 0, 0, 0, 0, offset))
+            fd.write(raw_name)
+        end_dir = fd.tell()
+        fd.write(struct.pack("<4s4H2LH", b"PK\005\006", 0, 0, len(central),
+                             len(central), end_dir - start_dir, start_dir,
+                             0))
+
+def make_zip_file(zip_file, case, scale):
+    """
+    make the zip file of case, and return the number of the members and
+    the total size of them.
+    """
+    members = list(iter_members(case, scale))
+    encryption = case.get("encryption")
+    if encryption == "zipcrypto":
+        write_zipcrypto(zip_file, case, members)
+    elif encryption == "aes":
+        with pyzipper.AESZipFile(zip_file, "w",
+                                 encryption=pyzipper.WZ_AES) as z:
+            z.setpassword(PASSWORD.encode())
+            for name, data in members:
+                # AESZipFile encodes the filename in utf-8 by itself.
+                zi = z.zipinfo_cls(name, date_time=(2020, 1, 1, 0, 0, 0))
+                zi.compress_type = compressions[case["compression"]]
+                z.writestr(zi, data)
+    else:
+        with zipfile.ZipFile(zip_file, "w") as z:
+            for name, data in members:
+                z.writestr(make_zipinfo(case, name), data)
+    return len(members), sum(len(x[1]) for x in members)
+
+def run(args, cwd):
+    """
+    run a command in cwd, and return the wall time and the peak RSS in MB.
+    the peak RSS is None if it isn't available on the platform.
+    """
+    t0 = perf_counter()
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, cwd=cwd)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in KB on Linux, and in bytes on macOS.
+        unit = 1 if sys.platform == "darwin" else 1024
+        rss = usage.ru_maxrss * unit / MB
+    else:
+        proc.wait()
+        rss = None
+    elapsed = perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"failed: {' '.join(args)}")
+    return elapsed, rss
+
+def operation_args(op, case, zip_file, work_dir):
+    """
+    return the command line of op, and the ratio of the members processed.
+    """
+    unzipx = [sys.executable, unzipx_path, "-q"]
+    if case.get("encryption"):
+        unzipx += ["-p", PASSWORD]
+    out_dir = ospath.join(work_dir, "out")
+    if op == "list":
+        return unzipx + [zip_file], 1
+    if op == "select":
+        if is_huge(case):
+            return unzipx + ["-x", "-D", out_dir, "-i", "1", zip_file], \
+                    1 / case["count"]
+        # exclude the other folders.  a pattern to be extracted without
+        # -i would select all members.
+        return unzipx + ["-x", "-D", out_dir, "-e", "フォルダ[1-9]/",
+                         zip_file], 0.1
+    if op == "extract":
+        return unzipx + ["-x", "-D", out_dir, zip_file], 1
+    if op == "create":
+        # zipx is run in the directory extracted to keep the names.
+        encoding = "cp932" if case["names"] == "cp932" else "utf-8"
+        zipx = [sys.executable, zipx_path, "-q", "-F", "-e", encoding,
+                "-Z", case["compression"]]
+        if case.get("encryption"):
+            zipx += ["-p", PASSWORD]
+        return zipx + [ospath.join(work_dir, "created.zip"), "."], 1
+    raise ValueError(op)
+
+def bench_case(case, opt, tmp_dir):
+    work_dir = ospath.join(tmp_dir, case["name"])
+    os.makedirs(work_dir)
+    zip_file = ospath.join(work_dir, "bench.zip")
+    nb_entries, nb_bytes = make_zip_file(zip_file, case, opt.scale)
+    src_dir = ospath.join(work_dir, "src")
+    results = []
+    for op in opt.operations:
+        if op == "create":
+            # zipx zips the files extracted.
+            unzipx = [sys.executable, unzipx_path, "-q", "-x", "-D", src_dir]
+            if case.get("encryption"):
+                unzipx += ["-p", PASSWORD]
+            subprocess.run(unzipx + [zip_file],
+                           stdout=subprocess.DEVNULL, check=True)
+        args, ratio = operation_args(op, case, zip_file, work_dir)
+        best = None
+        peak = None
+        for _ in range(opt.repeat):
+            shutil.rmtree(ospath.join(work_dir, "out"), ignore_errors=True)
+            elapsed, rss = run(args, src_dir if op == "create" else top_dir)
+            best = elapsed if best is None else min(best, elapsed)
+            if rss is not None:
+                peak = rss if peak is None else max(peak, rss)
+        entries = max(1, round(nb_entries * ratio))
+        size = nb_bytes * ratio
+        results.append({
+            "case": case["name"],
+            "op": op,
+            "wall": best,
+            "entries": entries,
+            "bytes": int(size),
+            "mb_per_s": size / MB / best,
+            "entries_per_s": entries / best,
+            "peak_rss_mb": peak,
+            })
+        print_result(results[-1], opt.baseline_results)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def compare(result, baseline_results):
+    """
+    return the ratio of the wall time to the baseline, or None.
+    """
+    base = baseline_results.get((result["case"], result["op"]))
+    if base is None:
+        return None
+    return result["wall"] / base["wall"]
+
+def print_result(result, baseline_results):
+    rss = result["peak_rss_mb"]
+    line = (f"{result['case']:24} {result['op']:8} "
+            f"{result['wall']:8.3f} s {result['mb_per_s']:9.1f} MB/s "
+            f"{result['entries_per_s']:10.0f} entries/s "
+            f"{'-' if rss is None else f'{rss:.0f}':>5} MB")
+    ratio = compare(result, baseline_results)
+    if ratio is not None:
+        line += f"  {(ratio - 1)*100:+6.1f}%"
+    print(line, flush=True)
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=top_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+ap = ArgumentParser(
+        description="benchmark suite of zipx and unzipx.",
+        formatter_class=ArgumentDefaultsHelpFormatter)
+ap.add_argument("-c", "--case", action="append", dest="case_patterns",
+                default=[],
+                help="""specify a glob pattern of the cases to be run.
+                This option can be specified in multiple.  the cases are
+                {}""".format(", ".join(x["name"] for x in cases)))
+ap.add_argument("--op", action="append", dest="operations", default=[],
+                choices=operations,
+                help="""specify an operation to be run.
+                This option can be specified in multiple.""")
+ap.add_argument("-s", "--scale", action="store", dest="scale", type=float,
+                default=1.0,
+                help="""specify the scale of the number of the tiny files
+                and the size of the huge files.""")
+ap.add_argument("-r", action="store", dest="repeat", type=int,
+                default=3, help="specify the number of the repeat.")
+ap.add_argument("-o", "--output", action="store", dest="output",
+                help="specify a JSON file to write the results.")
+ap.add_argument("--baseline", action="store", dest="baseline",
+                help="specify a JSON file of the results to be compared.")
+ap.add_argument("--threshold", action="store", dest="threshold", type=float,
+                default=10,
+                help="""specify the percentage of the wall time slower than
+                the baseline to be reported as a regression.""")
+ap.add_argument("--tmp-dir", action="store", dest="tmp_dir",
+                help="specify a directory to put the zip files generated.")
+opt = ap.parse_args()
+
+opt.operations = opt.operations or operations
+opt.baseline_results = {}
+if opt.baseline:
+    with open(opt.baseline, encoding="utf-8") as fd:
+        baseline = json.load(fd)
+    opt.baseline_results = {(x["case"], x["op"]): x
+                            for x in baseline["results"]}
+
+selected = [x for x in cases
+            if not opt.case_patterns or
+            any(fnmatch(x["name"], p) for p in opt.case_patterns)]
+results = []
+with TemporaryDirectory(dir=opt.tmp_dir) as tmp_dir:
+    for case in selected:
+        if case.get("encryption") == "aes" and pyzipper is None:
+            print(f"{case['name']}: skipped, pyzipper is required.")
+            continue
+        results.extend(bench_case(case, opt, tmp_dir))
+
+if opt.output:
+    with open(opt.output, "w", encoding="utf-8") as fd:
+        json.dump({
+            "meta": {
+                "date": strftime("%Y-%m-%dT%H:%M:%S"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "scale": opt.scale,
+                "repeat": opt.repeat,
+                },
+            "results": results,
+            }, fd, indent=2)
+
+regressions = [x for x in results
+               if (compare(x, opt.baseline_results) or 0) >
+               1 + opt.threshold/100]
+for x in regressions:
+    print(f"REGRESSION: {x['case']} {x['op']} is "
+          f"{(compare(x, opt.baseline_results) - 1)*100:.1f}% slower.")
+sys.exit(1 if regressions else 0)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+check of the update, freshen, and sync modes of zipx.
+it zips a small directory, changes, adds, and removes the files,
+and checks the members and the contents in the zip file after zipx
+runs with -u, -f, and --sync.  it exits with 1 if a check fails.
+"""
+
+import os
+import sys
+import zipfile
+import subprocess
+from os import path as ospath
+from tempfile import TemporaryDirectory
+
+top_dir = ospath.dirname(ospath.dirname(ospath.abspath(__file__)))
+zipx_path = ospath.join(top_dir, "zipx.py")
+
+def put(filename, data):
+    with open(filename, "wb") as fd:
+        fd.write(data)
+
+def touch_later(filename):
+    # a newer mtime than the member in the zip file.
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime + 10, st.st_mtime + 10))
+
+def make_tree(dirname):
+    os.makedirs(ospath.join(dirname, "sub"))
+    put(ospath.join(dirname, "a.txt"), b"a")
+    put(ospath.join(dirname, "b.txt"), b"b")
+    put(ospath.join(dirname, "sub", "c.txt"), b"c")
+
+def zipx(args, cwd):
+    proc = subprocess.run([sys.executable, zipx_path, "-q"] + args, cwd=cwd,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          text=True)
+    return proc.returncode, proc.stdout
+
+def contents(zip_file):
+    with zipfile.ZipFile(zip_file) as z:
+        return {x.filename: z.read(x) for x in z.infolist()
+                if not x.is_dir()}
+
+def check(label, args, cwd, zip_file, expected):
+    code, output = zipx(args, cwd)
+    if code != 0:
+        print(f"NG: {label}: exit {code}\n{output}")
+        return False
+    actual = contents(zip_file)
+    if actual != expected:
+        print(f"NG: {label}: {sorted(actual.items())}")
+        return False
+    print(f"OK: {label}")
+    return True
+
+def run_cases(tmpdir):
+    ok = True
+
+    # -u: a changed file is replaced, and a new file is added.
+    d = ospath.join(tmpdir, "u")
+    make_tree(d)
+    zipx(["u.zip", "u"], tmpdir)
+    put(ospath.join(d, "a.txt"), b"A")
+    touch_later(ospath.join(d, "a.txt"))
+    put(ospath.join(d, "d.txt"), b"d")
+    ok &= check("update", ["-u", "u.zip", "u"], tmpdir,
+                ospath.join(tmpdir, "u.zip"),
+                {"u/a.txt": b"A", "u/b.txt": b"b", "u/sub/c.txt": b"c",
+                 "u/d.txt": b"d"})
+
+    # -f: a changed file is replaced, but a new file is not added.
+    d = ospath.join(tmpdir, "f")
+    make_tree(d)
+    zipx(["f.zip", "f"], tmpdir)
+    put(ospath.join(d, "a.txt"), b"A")
+    touch_later(ospath.join(d, "a.txt"))
+    put(ospath.join(d, "d.txt"), b"d")
+    ok &= check("freshen", ["-f", "f.zip", "f"], tmpdir,
+                ospath.join(tmpdir, "f.zip"),
+                {"f/a.txt": b"A", "f/b.txt": b"b", "f/sub/c.txt": b"c"})
+
+    # -f doesn't make a zip file which doesn't exist.
+    code, output = zipx(["-f", "none.zip", "f"], tmpdir)
+    if code != 0 or ospath.exists(ospath.join(tmpdir, "none.zip")):
+        print(f"NG: freshen a missing zip file: exit {code}\n{output}")
+        ok = False
+    else:
+        print("OK: freshen a missing zip file")
+
+    # --sync: only a file is removed, nothing is written.
+    d = ospath.join(tmpdir, "s")
+    make_tree(d)
+    zipx(["s.zip", "s"], tmpdir)
+    os.unlink(ospath.join(d, "b.txt"))
+    ok &= check("sync removing only", ["-u", "--sync", "s.zip", "s"], tmpdir,
+                ospath.join(tmpdir, "s.zip"),
+                {"s/a.txt": b"a", "s/sub/c.txt": b"c"})
+
+    # --sync with the current directory as the root.
+    d = ospath.join(tmpdir, "dot")
+    make_tree(d)
+    zipx(["../dot.zip", "."], d)
+    os.unlink(ospath.join(d, "b.txt"))
+    put(ospath.join(d, "a.txt"), b"A")
+    touch_later(ospath.join(d, "a.txt"))
+    ok &= check("sync the current directory",
+                ["-u", "--sync", "../dot.zip", "."], d,
+                ospath.join(tmpdir, "dot.zip"),
+                {"a.txt": b"A", "sub/c.txt": b"c"})
+    return ok
+
+with TemporaryDirectory() as tmpdir:
+    ok = run_cases(tmpdir)
+
+sys.exit(0 if ok else 1)
@@ -1,258 +1,1946 @@
 #!/usr/bin/env python
 
-try:
-    import pyzipper as zipfile
-    import pyzipper as zipfile
-    from pyzipper.zipfile import _check_compression, BadZipFile
-    from pyzipper import AESZipFile as ZipFile
-except ModuleNotFoundError:
-    import zipfile
-    from zipfile import _check_compression, BadZipFile
-    from zipfile import ZipFile as ZipFile
-
-import argparse
-from os import makedirs
+# pyzipper is imported when an encrypted member is met.
+# see load_aes_zipfile().
+import zipfile
+from zipfile import _check_compression, BadZipFile
+from zipfile import _EndRecData, _ECD_LOCATION
+from zipfile import structFileHeader, stringFileHeader
+from zipfile import sizeFileHeader
+from zipfile import ZipFile as ZipFile
+
+import sys
+from bisect import bisect_right
+from itertools import filterfalse
+from operator import attrgetter
+import threading
+import io
+from collections import OrderedDict
+from array import array
+from time import mktime, perf_counter
+import mmap
+import struct
+from zlib import crc32
+from os import cpu_count, makedirs, replace, scandir, stat, unlink, utime
+from os import chmod, fsync
+from os import open as os_open, close as os_close, O_RDONLY
 from os import path as ospath
-import unicodedata
 import re
 
-def is_target_file(n, filename):
+from zipstats import Stats
+
+# characters which make a pattern a regular expression.
+regex_special_chars = set(".^$*+?{}[]\\|()")
+# a backreference can't be used in a combined pattern.
+re_backreference = re.compile(r"\\[1-9]|\(\?P=")
+# the size of the buffer reused while extracting the files.
+DEFAULT_BUFFER_SIZE = 1024*1024
+# the number of the members held in memory to be written behind.
+DEFAULT_IO_QUEUE_SIZE = 64
+# the durability of the files extracted.  "file" syncs each file, and
+# "batch" syncs the files and their directories once at the end.
+valid_sync_options = ["none", "file", "batch"]
+
+# the exceptions of a broken zip file.  the one of pyzipper is added
+# when it is loaded.
+bad_zipfile_errors = (BadZipFile,)
+
+class UnzipxError(Exception):
+    pass
+
+class NumberSet:
+    """
+    a set of the file numbers specified by the -i option.
+    e.g. "2", "2,3", or "2,10-20,100-5000" (1 origin).
+    the numbers are held as merged ranges.
+    """
+    def __init__(self, spec=None):
+        ranges = []
+        if spec:
+            for x in str(spec).split(","):
+                x = x.strip()
+                if not x:
+                    continue
+                if "-" in x:
+                    start, end = x.split("-", 1)
+                    start, end = int(start), int(end)
+                else:
+                    start = end = int(x)
+                if start < 1 or start > end:
+                    raise ValueError(f"invalid range of the file number: {x}")
+                ranges.append((start, end))
+        ranges.sort()
+        self.starts = []
+        self.ends = []
+        for start, end in ranges:
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, n):
+        i = bisect_right(self.starts, n) - 1
+        return i >= 0 and n <= self.ends[i]
+
+    def __bool__(self):
+        return bool(self.starts)
+
+class PatternSet:
+    """
+    a set of the patterns compiled.  like re.match(), a pattern matches
+    the beginning of the filename.
+    the patterns without any special character are looked up by a hash
+    set for each length.  the others are combined into a single regex.
+    """
+    def __init__(self, patterns):
+        self.literals = {}
+        regexes = []
+        separated = []
+        for x in patterns:
+            if not regex_special_chars.intersection(x):
+                self.literals.setdefault(len(x), set()).add(x)
+                continue
+            re.compile(x)   # raise re.error if the pattern is invalid.
+            if re_backreference.search(x):
+                separated.append(x)
+            else:
+                regexes.append(x)
+        self.regexes = []
+        if regexes:
+            try:
+                self.regexes.append(re.compile(
+                        "|".join([f"(?:{x})" for x in regexes])))
+            except re.error:
+                # e.g. global flags in the middle of the patterns.
+                separated.extend(regexes)
+        self.regexes.extend([re.compile(x) for x in separated])
+
+    def match(self, filename):
+        for size, names in self.literals.items():
+            if filename[:size] in names:
+                return True
+        for regex in self.regexes:
+            if regex.match(filename):
+                return True
+        return False
+
+class TargetSelector:
     """
     evaluating in below order.
-    1. if the number of the filename is matched with n.
-    2. if the filename is not matched with a regex in opt.excluding_files.
-    3. if the filename is matched with a regex in opt.ex_files.
-    4. if extract_file_number_list is empty or None.
+    1. if the number of the filename is matched with numbers.
+    2. if the filename is not matched with a regex in excluding_files.
+    3. if the filename is matched with a regex in ex_files.
+    4. if numbers is empty.
     """
-    if n in extract_file_number_list:
-        return True
-    for regex in opt.excluding_files:
-        if re.match(regex, filename):
+    def __init__(self, numbers, excluding_files, ex_files):
+        self.numbers = numbers
+        self.excluding_files = PatternSet(excluding_files)
+        self.ex_files = PatternSet(ex_files)
+
+    def match(self, n, filename):
+        if n in self.numbers:
+            return True
+        if self.excluding_files.match(filename):
             return False
-    for regex in opt.ex_files:
-        if re.match(regex, filename):
+        if self.ex_files.match(filename):
             return True
-    if not extract_file_number_list:
-        return True
-    return False
+        if not self.numbers:
+            return True
+        return False
+
+def load_rules(rule_file):
+    """
+    read the patterns from rule_file, one pattern in a line.
+    a line starting with "!" is a pattern to be ignored.
+    an empty line and a line starting with "#" are skipped.
+    "-" means the standard input.
+    return a tuple of the list of the patterns to be ignored, and
+    the list of the patterns to be extracted.
+    """
+    excluding_files = []
+    ex_files = []
+    if rule_file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(rule_file, encoding="utf-8") as fd:
+            lines = fd.read().splitlines()
+    for line in lines:
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("!"):
+            excluding_files.append(line[1:])
+        else:
+            ex_files.append(line)
+    return excluding_files, ex_files
+
+class TimedWriter:
+    """
+    a file object taking the time to write into fd for --stats.
+    """
+    def __init__(self, fd, stats):
+        self.fd = fd
+        self.stats = stats
+
+    def write(self, data):
+        t0 = perf_counter()
+        n = self.fd.write(data)
+        self.stats.add_phase("write", perf_counter() - t0, len(data))
+        return n
+
+def copy_member(z, zi, fd, buf):
+    """
+    copy the contents of zi into fd in a streaming manner.
+    buf is a preallocated bytearray reused for every member so that
+    the memory usage doesn't depend on the size of the member.
+    """
+    view = memoryview(buf)
+    with z.open(zi) as src:
+        while True:
+            size = src.readinto(buf)
+            if not size:
+                break
+            fd.write(view[:size])
+
+def copy_stored_member(z, zi, fd, chunk_size):
+    """
+    copy a stored and unencrypted member into fd directly from the zip file
+    mapped in memory, without making any intermediate bytes object.
+    the CRC is checked while copying.
+    return False if the zip file can't be mapped.
+    """
+    mm = z.get_mmap()
+    if mm is None:
+        return False
+    offset = zi.header_offset
+    fheader = mm[offset:offset + sizeFileHeader]
+    if len(fheader) != sizeFileHeader:
+        raise BadZipFile("Truncated file header")
+    fheader = struct.unpack(structFileHeader, fheader)
+    if fheader[0] != stringFileHeader:
+        raise BadZipFile("Bad magic number for file header")
+    # same check as ZipFile.open()
+    offset += sizeFileHeader
+    fname = mm[offset:offset + fheader[10]]
+    if zi.flag_bits & 0x800:
+        fname_str = fname.decode("utf-8")
+    else:
+        fname_str = fname.decode("cp437")
+    if fname_str != zi.orig_filename:
+        raise BadZipFile(
+            'File name in directory %r and header %r differ.'
+            % (zi.orig_filename, fname))
+    start = offset + fheader[10] + fheader[11]
+    end = start + zi.compress_size
+    if end > len(mm):
+        raise BadZipFile("Truncated file")
+    crc = 0
+    with memoryview(mm) as view:
+        for pos in range(start, end, chunk_size):
+            with view[pos:min(pos + chunk_size, end)] as chunk:
+                crc = crc32(chunk, crc)
+                fd.write(chunk)
+    if crc != zi.CRC:
+        raise BadZipFile("Bad CRC-32 for file %r" % zi.filename)
+    return True
 
-def do_extract(z, zi, dname, fpath):
+def check_compression(zi):
     # check if the zipped file can be read.
     try:
         _check_compression(zi.compress_type)
     except Exception as e:
-        print(f"ERROR: {e}")
         if "compression method is not supported" in str(e):
-            print("NOTE: pyzipper may be required. try pip install pyzipper.")
+            raise UnzipxError(f"{e}\nNOTE: pyzipper may be required. "
+                              "try pip install pyzipper.") from e
         raise
+
+def make_dest_dir(dname, recursive=True, quiet=True):
     # create directories.
-    if dname and opt.recursive:
+    if dname and recursive:
         try:
             makedirs(dname, mode=511, exist_ok=False)
         except FileExistsError:
             # the directory exists.
             pass
         else:
-            if not opt.quiet:
+            if not quiet:
                 print("{} has been created.".format(dname))
-    # extract the file
-    if not zi.is_dir():
+
+def copy_contents(z, zi, fd, buf, fpath):
+    """
+    copy the contents of zi into fd.  fpath is the path to be reported.
+    """
+    try:
+        if (zi.compress_type == zipfile.ZIP_STORED and
+                not zi.flag_bits & 0x1 and
+                copy_stored_member(z, zi, fd, len(buf))):
+            return
+        copy_member(z, zi, fd, buf)
+    except bad_zipfile_errors as e:
+        # ignore only the filename in the local header different from
+        # the one in the central directory.  a bad CRC or a truncated
+        # member is reported.
+        if "File name in directory" not in str(e):
+            raise
+    except RuntimeError as e:
+        if "password required" in str(e):
+            raise UnzipxError(f"password required for {fpath}") from e
+        raise
+
+def restore_attributes(fpath, zi):
+    """
+    set the mtime of fpath to date_time of zi, and the permissions to
+    the ones in external_attr if zi was made on Unix.
+    setuid, setgid, and the sticky bit are not restored.
+    """
+    mtime = mktime(zi.date_time + (0, 0, -1))
+    utime(fpath, (mtime, mtime))
+    mode = (zi.external_attr >> 16) & 0o777
+    if zi.create_system == 3 and mode:
+        chmod(fpath, mode)
+
+def sync_directory(dpath):
+    """
+    sync the entries of the directory dpath.
+    a directory can't be opened on Windows, and it is skipped.
+    """
+    if sys.platform == "win32":
+        return
+    try:
+        fd = os_open(dpath, O_RDONLY)
+        try:
+            fsync(fd)
+        finally:
+            os_close(fd)
+    except OSError as e:
+        raise UnzipxError(f"failed to sync {dpath}: {e}") from e
+
+class FileWriter:
+    """
+    write the files extracted.  with jobs more than 0, a member fitting in
+    the buffer is decompressed into memory, and written behind by a pool
+    of the I/O threads, so that the latency to create and close the files
+    overlaps with the decompression.  at most queue_size members are
+    held in memory.  sync is one of valid_sync_options.  if restore,
+    the mtime and the permissions are restored as well.
+    """
+    def __init__(self, jobs=0, queue_size=DEFAULT_IO_QUEUE_SIZE,
+                 sync="none", restore=False, stats=None):
+        if sync not in valid_sync_options:
+            raise UnzipxError(f"invalid sync option {sync}")
+        self.sync = sync
+        self.restore = restore
+        self.stats = stats
+        self._pool = None
+        if jobs > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(max_workers=jobs)
+            self._slots = threading.BoundedSemaphore(queue_size)
+        # the files to be synced at the end in the batch mode.
+        self._paths = []
+        self._lock = threading.Lock()
+
+    def accepts(self, zi, buf):
+        return self._pool is not None and zi.file_size <= len(buf)
+
+    def submit(self, zi, fpath, data):
+        """
+        write data into fpath in an I/O thread, and return the future.
+        it blocks while the queue is full.
+        """
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._write, zi, fpath, data)
+        except:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _write(self, zi, fpath, data):
+        if self.stats is not None:
+            t0 = perf_counter()
+        with open(fpath, "wb") as fd:
+            fd.write(data)
+            self.finish(fd, zi, fpath)
+        if self.restore:
+            restore_attributes(fpath, zi)
+        if self.stats is not None:
+            self.stats.add_phase("write", perf_counter() - t0, len(data))
+
+    def finish(self, fd, zi, fpath):
+        """
+        called before fd, the file of fpath written, is closed.
+        """
+        if self.sync == "file":
+            if self.stats is not None:
+                t0 = perf_counter()
+            fd.flush()
+            fsync(fd.fileno())
+            if self.stats is not None:
+                self.stats.add_phase("sync", perf_counter() - t0)
+        elif self.sync == "batch":
+            with self._lock:
+                self._paths.append(fpath)
+
+    def close(self):
+        """
+        wait for the files written behind, and sync them in the batch mode.
+        the directories having the files are synced as well, so that
+        the entries of the files are durable.  only the files written by
+        this writer are synced, not the whole filesystem.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.sync != "batch":
+            return
+        if self.stats is not None:
+            t0 = perf_counter()
+        dirs = set()
+        for fpath in self._paths:
+            try:
+                with open(fpath, "ab") as fd:
+                    fsync(fd.fileno())
+            except OSError as e:
+                raise UnzipxError(f"failed to sync {fpath}: {e}") from e
+            dirs.add(ospath.dirname(fpath) or ".")
+        self._paths = []
+        for dpath in sorted(dirs):
+            sync_directory(dpath)
+        if self.stats is not None:
+            self.stats.add_phase("sync", perf_counter() - t0)
+
+def extract_file(z, zi, fpath, buf, stats=None, writer=None):
+    """
+    write the contents of zi into fpath.
+    the caller has to report the exception raised.
+    writer is a FileWriter or None.  if it writes zi behind, the future of
+    the writing is returned.  otherwise None is returned.
+    """
+    if stats is not None:
+        t0 = perf_counter()
+    try:
+        if writer is not None and writer.accepts(zi, buf):
+            data = io.BytesIO()
+            copy_contents(z, zi, data, buf, fpath)
+            return writer.submit(zi, fpath, data.getbuffer())
         with open(fpath, "wb") as fd:
+            if stats is not None:
+                copy_contents(z, zi, TimedWriter(fd, stats), buf, fpath)
+            else:
+                copy_contents(z, zi, fd, buf, fpath)
+            if writer is not None:
+                writer.finish(fd, zi, fpath)
+        if writer is not None and writer.restore:
+            restore_attributes(fpath, zi)
+    finally:
+        if stats is not None:
+            elapsed = perf_counter() - t0
+            stats.add_phase("extract", elapsed, zi.file_size)
+            stats.add_member(zi, fpath, elapsed)
+    return None
+
+def decode_filename(zi, encoding):
+    """
+    get the filename including the path.
+    Because zipfile.py converts the filename as it was cp437
+    when flag_bits doesn't have utf-8 bit (0x800).
+    The problem is Windows OS put the filename into the zip file
+    as it is.  And, in Japan, it uses Shift_JIS (cp932) Usually.
+    So, zipfile.py should converts with cp932 in that case.
+    The strategy here is that:
+        TBD...
+    """
+    if encoding is None:
+        c_fname = zi.filename
+    elif encoding == "auto":
+        if zi.flag_bits & 0x800:
+            c_fname = zi.filename
+        else:
+            """
+            some zip software (e.g. mac) doesn't set utf-8 bit even when
+            the encoding of the filename was in utf-8.
+            So, firstly here try to decode cp932, then try to decode utf-8.
+            """
             try:
-                fd.write(z.read(zi))
-            except BadZipFile as e:
-                if "File name in directory" in str(e):
+                c_fname = zi.filename.encode("cp437").decode("utf-8")
+            except:
+                c_fname = zi.filename.encode("cp437").decode("cp932")
+    else:
+        """
+        if flag_bits has 0x800, zipfile.py converted with utf-8.
+        so, here needs to back conversion by utf-8,
+        then convert it with one specified.
+        if not, zipfile.py uses cp437 as well.
+        """
+        if zi.flag_bits & 0x800:
+            c_fname = zi.filename.encode("utf-8").decode(encoding)
+        else:
+            c_fname = zi.filename.encode("cp437").decode(encoding)
+    return c_fname
+
+# the number of the names to detect the encoding.
+detect_sample_size = 1000
+
+def detect_filename_encoding(names, raw_names):
+    """
+    choose one encoding, either utf-8 or cp932, for the filenames without
+    the utf-8 bit in a zip file.  names are the ones decoded by zipfile.py
+    in cp437, and raw_names is the bytes of them joined by a null byte,
+    which never appears in the filename.  all names are checked at once
+    in utf-8.  if it fails, the encoding is decided by voting of the
+    non-ascii names sampled.
+    utf-8 wins a tie because a cp932 name is rarely valid in utf-8.
+    return a dict of the decision.
+    """
+    non_ascii = list(filterfalse(str.isascii, names))
+    report = {
+        "encoding": "utf-8",
+        "names": len(names),
+        "ascii": len(names) - len(non_ascii),
+        "votes": {"utf-8": 0, "cp932": 0},
+        "sampled": 0,
+        "confidence": 1.0,
+        }
+    if not non_ascii:
+        return report
+    votes = report["votes"]
+    try:
+        raw_names.decode("utf-8")
+    except UnicodeDecodeError:
+        step = max(1, len(non_ascii) // detect_sample_size)
+        samples = non_ascii[::step]
+        report["sampled"] = len(samples)
+        for x in samples:
+            raw_name = x.encode("cp437")
+            for codec in votes:
+                try:
+                    raw_name.decode(codec)
+                except UnicodeDecodeError:
                     pass
-                # ignore this exception.
-            except RuntimeError as e:
-                if "password required" in str(e):
-                    print(f"ERROR: password required for {fpath}")
-                    exit(1)
                 else:
+                    votes[codec] += 1
+    else:
+        votes["utf-8"] = report["sampled"] = len(non_ascii)
+    if votes["cp932"] > votes["utf-8"]:
+        report["encoding"] = "cp932"
+    report["confidence"] = votes[report["encoding"]] / report["sampled"]
+    return report
+
+def decode_raw_name(raw_name, encoding):
+    # fall back to another encoding for a name not decoded.
+    try:
+        return raw_name.decode(encoding)
+    except UnicodeDecodeError:
+        return raw_name.decode("cp932" if encoding == "utf-8" else "utf-8")
+
+def decode_filenames(infolist, encoding):
+    """
+    decode all filenames in the zip file.
+    in the case of "auto", the encoding is detected for the whole archive
+    at once, and the names are decoded in a single pass.
+    return a tuple of the list of the names, and the report of the
+    detection, or None if encoding is not "auto".
+    """
+    if encoding != "auto":
+        return [decode_filename(zi, encoding) for zi in infolist], None
+    c_fnames = list(map(attrgetter("filename"), infolist))
+    flagged = [i for i, zi in enumerate(infolist) if zi.flag_bits & 0x800]
+    if flagged:
+        # the names with the utf-8 bit are left as they are.
+        flagged = set(flagged)
+        index = [i for i in range(len(infolist)) if i not in flagged]
+        names = [c_fnames[i] for i in index]
+    else:
+        names = c_fnames
+    raw_names = "\0".join(names).encode("cp437")
+    report = detect_filename_encoding(names, raw_names)
+    report["entries"] = len(infolist)
+    if report["ascii"] == len(names):
+        return c_fnames, report
+    codec = report["encoding"]
+    try:
+        names = raw_names.decode(codec).split("\0")
+    except UnicodeDecodeError:
+        names = [decode_raw_name(x.encode("cp437"), codec) for x in names]
+    if flagged:
+        for i, name in zip(index, names):
+            c_fnames[i] = name
+        return c_fnames, report
+    return names, report
+
+def print_encoding_report(report, encoding):
+    if report is None:
+        print(f"encoding: {encoding} (specified)")
+        return
+    votes = report["votes"]
+    print("encoding: {} (confidence {:.2f}, votes utf-8={} cp932={} "
+          "in {} sampled, entries={}, no utf-8 bit={}, ascii={})".format(
+            report["encoding"], report["confidence"],
+            votes["utf-8"], votes["cp932"], report["sampled"],
+            report["entries"], report["names"], report["ascii"]))
+
+class IndexedZipFileMixin:
+    """
+    ZipFile taking the members from an index made by make_index(),
+    instead of parsing the central directory in the zip file.
+    """
+    def __init__(self, file, index=None, **kwargs):
+        self._index = index
+        self._mmap = None
+        super().__init__(file, **kwargs)
+
+    def get_mmap(self):
+        """
+        return the zip file mapped in memory for reading,
+        or None if it can't be mapped.
+        """
+        if self._mmap is None:
+            try:
+                self._mmap = mmap.mmap(self.fp.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                self._mmap = False
+        return self._mmap or None
+
+    def close(self):
+        if self._mmap:
+            self._mmap.close()
+        self._mmap = None
+        super().close()
+
+    def _RealGetContents(self):
+        if self._index is None:
+            return super()._RealGetContents()
+        self._comment = self._index["comment"]
+        self.start_dir = self._index["start_dir"]
+        self.filelist = self._index["infolist"]
+        self.NameToInfo = {zi.filename: zi for zi in self.filelist}
+
+class IndexedZipFile(IndexedZipFileMixin, ZipFile):
+    pass
+
+# IndexedZipFile to decrypt the members.
+aes_zipfile_class = None
+
+def load_aes_zipfile():
+    """
+    return IndexedZipFile based on AESZipFile of pyzipper, or the one of
+    zipfile.py if pyzipper is not installed.  pyzipper is imported here
+    because its crypto backends take a while to be imported.
+    """
+    global aes_zipfile_class, bad_zipfile_errors
+    if aes_zipfile_class is None:
+        try:
+            from pyzipper import AESZipFile, BadZipFile as AESBadZipFile
+        except ModuleNotFoundError:
+            aes_zipfile_class = IndexedZipFile
+        else:
+            class IndexedAESZipFile(IndexedZipFileMixin, AESZipFile):
+                pass
+            aes_zipfile_class = IndexedAESZipFile
+            bad_zipfile_errors = (BadZipFile, AESBadZipFile)
+    return aes_zipfile_class
+
+def make_index(z):
+    return {
+        "comment": z.comment,
+        "start_dir": z.start_dir,
+        "infolist": z.infolist(),
+        "names": {},
+        }
+
+def zipinfo_slots(cls):
+    slots = []
+    for c in reversed(cls.__mro__):
+        for x in getattr(c, "__slots__", ()):
+            if x not in slots:
+                slots.append(x)
+    return slots
+
+class IndexCache:
+    """
+    on-disk cache of the central directory and the decoded filenames.
+    an index file is made for each zip file in cache_dir, and is keyed by
+    the path, the size, the mtime, and the offset of the end of central
+    directory record of the zip file.  a stale or corrupt index is removed.
+    the least recently used ones are removed when the total size of
+    the index files exceeds max_size.
+    the index files are unpickled, so cache_dir has to be owned by
+    the user, and not writable by the others.
+    """
+    version = 2
+    suffix = ".idx"
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if sys.platform != "win32":
+            from os import getuid
+            st = stat(cache_dir)
+            if st.st_uid != getuid() or st.st_mode & 0o022:
+                raise UnzipxError(f"the index cache {cache_dir} is writable "
+                                  "by the other users.")
+
+    def index_path(self, zip_file):
+        from hashlib import sha1
+        name = sha1(ospath.abspath(zip_file).encode("utf-8")).hexdigest()
+        return ospath.join(self.cache_dir, name + self.suffix)
+
+    def archive_key(self, zip_file):
+        """
+        return the key of the zip file, or None if it is not a zip file.
+        only the end of central directory record is read.
+        """
+        with open(zip_file, "rb") as fp:
+            st = stat(fp.fileno())
+            endrec = _EndRecData(fp)
+        if endrec is None:
+            return None
+        return (self.version, ospath.abspath(zip_file), st.st_size,
+                st.st_mtime_ns, endrec[_ECD_LOCATION])
+
+    def load(self, zip_file):
+        """
+        return a tuple of the key of the zip file, and the index cached,
+        or None if there is no valid index.
+        """
+        key = self.archive_key(zip_file)
+        if key is None:
+            return None, None
+        path = self.index_path(zip_file)
+        import pickle
+        try:
+            with open(path, "rb") as fd:
+                cached = pickle.load(fd)
+            if cached["key"] != key:
+                raise ValueError("stale index")
+            cls = zipfile.ZipInfo
+            if cached["slots"] != zipinfo_slots(cls):
+                raise ValueError("unknown ZipInfo")
+            infolist = []
+            for values in cached["entries"]:
+                zi = cls.__new__(cls)
+                for name, value in zip(cached["slots"], values):
+                    setattr(zi, name, value)
+                infolist.append(zi)
+        except FileNotFoundError:
+            return key, None
+        except Exception:
+            # stale or corrupt.
+            self.remove(path)
+            return key, None
+        utime(path)
+        return key, {
+            "comment": cached["comment"],
+            "start_dir": cached["start_dir"],
+            "infolist": infolist,
+            "names": cached["names"],
+            }
+
+    def store(self, zip_file, key, index):
+        if key is None:
+            return
+        infolist = index["infolist"]
+        slots = zipinfo_slots(type(infolist[0])) if infolist else []
+        try:
+            entries = [tuple([getattr(zi, x) for x in slots])
+                       for zi in infolist]
+        except AttributeError:
+            # some members are not complete.  don't cache it.
+            return
+        import pickle
+        from tempfile import mkstemp
+        path = self.index_path(zip_file)
+        # unique among the threads and the batch worker processes.
+        fd, tmp_path = mkstemp(suffix=".tmp", dir=self.cache_dir)
+        with open(fd, "wb") as fd:
+            pickle.dump({
+                "key": key,
+                "comment": index["comment"],
+                "start_dir": index["start_dir"],
+                "slots": slots,
+                "entries": entries,
+                "names": index["names"],
+                }, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(tmp_path, path)
+        self.evict()
+
+    def remove(self, path):
+        try:
+            unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        # remove the least recently used index files.
+        files = []
+        total = 0
+        with scandir(self.cache_dir) as fd:
+            for entry in fd:
+                if entry.name.endswith(self.suffix) and entry.is_file():
+                    st = entry.stat()
+                    files.append((st.st_mtime_ns, st.st_size, entry.path))
+                    total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            self.remove(path)
+            total -= size
+
+class BlockCache:
+    """
+    an LRU cache of the blocks of block_size bytes read by read_range(),
+    shared by RangedFile and its clones.  at most cache_size bytes
+    are kept.  requests and fetched are the number of the requests and
+    the bytes fetched.
+    """
+    def __init__(self, read_range, size, block_size, cache_size,
+                 stats=None):
+        self.read_range = read_range
+        self.size = size
+        self.block_size = block_size
+        self.max_blocks = max(1, cache_size // block_size)
+        self.last = max(0, size - 1) // block_size
+        self.stats = stats
+        self.requests = 0
+        self.fetched = 0
+        self._blocks = OrderedDict()
+        # the events of the blocks being fetched.
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, index, ahead=1):
+        """
+        return a tuple of the block of index, and whether it is fetched.
+        the blocks not cached from index are fetched in a request up to
+        ahead blocks.  a block being fetched by another thread is waited.
+        """
+        while True:
+            with self._lock:
+                block = self._blocks.get(index)
+                if block is not None:
+                    self._blocks.move_to_end(index)
+                    return block, False
+                event = self._pending.get(index)
+                if event is None:
+                    count = 1
+                    while (count < ahead and index + count <= self.last and
+                           index + count not in self._blocks and
+                           index + count not in self._pending):
+                        count += 1
+                    event = threading.Event()
+                    for i in range(index, index + count):
+                        self._pending[i] = event
+                    break
+            # the block may be evicted after it is fetched.  retry.
+            event.wait()
+        try:
+            return self._fetch(index, count), True
+        finally:
+            with self._lock:
+                for i in range(index, index + count):
+                    del self._pending[i]
+            event.set()
+
+    def _fetch(self, index, count):
+        # read count blocks from index, and return the first one.
+        offset = index * self.block_size
+        size = min(count * self.block_size, self.size - offset)
+        if self.stats is not None:
+            t0 = perf_counter()
+        data = self.read_range(offset, size)
+        if len(data) != size:
+            raise OSError(f"{len(data)} bytes read at {offset} "
+                          f"instead of {size} bytes")
+        if self.stats is not None:
+            self.stats.add_phase("fetch", perf_counter() - t0, size)
+        blocks = [data[i:i + self.block_size]
+                  for i in range(0, size, self.block_size)]
+        with self._lock:
+            self.requests += 1
+            self.fetched += size
+            for i, block in enumerate(blocks):
+                self._blocks[index + i] = block
+                self._blocks.move_to_end(index + i)
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return blocks[0]
+
+class RangedFile(io.RawIOBase):
+    """
+    a read-only seekable file of size bytes, which reads the blocks by
+    read_range(offset, size), a function returning the bytes in the range.
+    e.g. HTTPRangeReader.  it is passed to ZipFile instead of the path so
+    that only the end of central directory record and the central directory
+    are read to list the files, and only the members to extract them.
+
+    the blocks are kept in a BlockCache of cache_size bytes.  when
+    the blocks are read sequentially, the following blocks are fetched in
+    the same request up to read_ahead blocks.
+    stats is a Stats to count the fetches, or None.
+    """
+    def __init__(self, read_range, size, name=None, block_size=256*1024,
+                 cache_size=64*1024*1024, read_ahead=16, stats=None,
+                 cache=None):
+        super().__init__()
+        if cache is None:
+            cache = BlockCache(read_range, size, block_size,
+                               max(cache_size, read_ahead*block_size), stats)
+        self.cache = cache
+        self.size = size
+        self.name = name
+        self.read_ahead = max(1, read_ahead)
+        self._pos = 0
+        self._next_block = None
+        self._ahead = 1
+
+    def clone(self):
+        """
+        return another file sharing the cache, but having its own position.
+        """
+        return RangedFile(None, self.size, self.name,
+                          read_ahead=self.read_ahead, cache=self.cache)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if pos < 0:
+            raise OSError(f"negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        n = min(len(view), max(0, self.size - self._pos))
+        block_size = self.cache.block_size
+        done = 0
+        while done < n:
+            index, offset = divmod(self._pos + done, block_size)
+            block = self._get_block(index)
+            size = min(len(block) - offset, n - done)
+            view[done:done + size] = block[offset:offset + size]
+            done += size
+        self._pos += done
+        return done
+
+    def _get_block(self, index):
+        if self._next_block is None or \
+                not self._next_block - 1 <= index <= self._next_block:
+            # not sequential.
+            self._ahead = 1
+        block, fetched = self.cache.get(index, self._ahead)
+        if fetched:
+            # grow the read-ahead while the blocks are read sequentially.
+            self._ahead = min(self._ahead * 2, self.read_ahead)
+        self._next_block = index + 1
+        return block
+
+class HTTPRangeReader:
+    """
+    read_range() of RangedFile reading url by HTTP Range requests.
+    the connections are kept alive for each thread.
+    headers are added to the requests, e.g. Authorization.
+    """
+    def __init__(self, url, headers=None, timeout=60):
+        from urllib.parse import urlsplit
+        self.url = url
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        u = urlsplit(url)
+        self.scheme = u.scheme
+        self.netloc = u.netloc
+        self.path = u.path or "/"
+        if u.query:
+            self.path += "?" + u.query
+        self._local = threading.local()
+        content_range = self._request(0, 1)[1]
+        self.size = int(content_range.rsplit("/", 1)[1])
+
+    def _connection(self):
+        import http.client
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.scheme == "https":
+                conn = http.client.HTTPSConnection(self.netloc,
+                                                   timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self.netloc,
+                                                  timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, offset, size):
+        import http.client
+        headers = dict(self.headers)
+        headers["Range"] = f"bytes={offset}-{offset + size - 1}"
+        for retry in (True, False):
+            conn = self._connection()
+            try:
+                conn.request("GET", self.path, headers=headers)
+                res = conn.getresponse()
+                data = res.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # the connection kept alive may have been closed.
+                conn.close()
+                self._local.conn = None
+                if not retry:
                     raise
-            except Exception as e:
-                print(f"ERROR: {e}")
-                raise
-    if not opt.quiet:
-        print("extract {} into {}".format(n, fpath))
+        if res.status != 206:
+            raise UnzipxError(f"{self.url} returned {res.status} "
+                              "to a range request.")
+        return data, res.headers.get("Content-Range", "")
+
+    def __call__(self, offset, size):
+        return self._request(offset, size)[0]
+
+def is_url(zip_file):
+    return isinstance(zip_file, str) and (zip_file.startswith("http://") or
+                                          zip_file.startswith("https://"))
+
+def open_url(url, block_size=256*1024, cache_size=64*1024*1024,
+             read_ahead=16, stats=None):
+    """
+    return RangedFile reading url by HTTP Range requests.
+    """
+    reader = HTTPRangeReader(url)
+    return RangedFile(reader, reader.size, name=url, block_size=block_size,
+                      cache_size=cache_size, read_ahead=read_ahead,
+                      stats=stats)
 
 # normalization
 valid_unicode_normalize_options = ["NFC", "NFKC", "NFD", "NFKD"]
 
-ap = argparse.ArgumentParser(
-        description="unzip helper to extract non utf-8 files.",
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-ap.add_argument("zip_file", help="specify a zipped file.")
-ap.add_argument("ex_files", nargs="*",
-                help="specify files (regex acceptable) to be extracted.")
-ap.add_argument("--prefix", action="store", dest="prefix", default="",
-                help="specify a prefix.")
-ap.add_argument("-i", action="store", dest="file_number",
-                help="""specify a file number or list to be extracted.
-                e.g. -i 2, or -i 2,3 (1 origin)
-                """)
-ap.add_argument("-p", "--password", action="store", dest="password",
-                help="specify the password for the zipped file.")
-ap.add_argument("-x", action="store_true", dest="extract_mode",
-                help="extract the contents.  default is to list the files.")
-ap.add_argument("-e", action="append", dest="excluding_files", default=[],
-                help="specify a file name (regex acceptable) to be ignored."
-                "This option can be specified in multiple.")
-ap.add_argument("-E", "--encoding", action="store", dest="filename_encoding",
-                default="auto",
-                help="""specify a filename encoding in the zip file.
-                e.g. cp932, utf-8.  default is cp932.""")
-ap.add_argument("--no-convertion", action="store_false", dest="conversion",
-                help="disable to convert the filename.")
-ap.add_argument("-D", "--dest-dir", action="store", dest="dest_dir",
-                help="specify a directory to store the files extracted.")
-ap.add_argument("-R", action="store_false", dest="recursive",
-                help="""extract only the 1st level of files,
-                not including the sub directories.""")
-ap.add_argument("-n", "--normalize", action="store", dest="unicode_normalize",
-                help=f"""specify a string for normalization of the filename.
-                valid string are {valid_unicode_normalize_options}""")
-ap.add_argument("-q", "--quiet", action="store_true", dest="quiet",
-                help="enable quiet mode.")
-ap.add_argument("-d", action="store_true", dest="debug",
-                help="enable debug mode.")
-opt = ap.parse_args()
-
-# filename encoding
-if not opt.conversion:
-    opt.filename_encoding = None
-
-# make the list for extracting.
-extract_file_number_list = []
-if opt.file_number is None:
-    # means all files.
-    pass
-elif isinstance(opt.file_number, int):
-    extract_file_number_list = [opt.file_number]
-elif isinstance(opt.file_number, str):
-    extract_file_number_list = [int(_) for _ in opt.file_number.split(",")]
-else:
-    ap.print_help()
-    exit(1)
-if extract_file_number_list and not opt.extract_mode:
-    print("ERROR: the -x option is required when the -i option is used.")
-    exit(1)
-
-with ZipFile(opt.zip_file) as z:
-    n = 1
-    file_info = []
-    if opt.password:
-        z.setpassword(bytes(opt.password, "ascii"))
-    for zi in z.infolist():
+class Member:
+    """
+    a member of the zip file with the filename decoded.
+    number is the number of the member (1 origin), dirname is the directory
+    to be created, and path is the path to extract the member into.
+    """
+    __slots__ = ("number", "zipinfo", "filename", "dirname", "path")
+
+    def __init__(self, number, zipinfo, filename, dirname, path):
+        self.number = number
+        self.zipinfo = zipinfo
+        self.filename = filename
+        self.dirname = dirname
+        self.path = path
+
+    def __repr__(self):
+        return f"<Member {self.number} {self.filename!r}>"
+
+class ExtractResult:
+    """
+    extracted is the list of the tuples of the number and the path of
+    the files extracted.  errors is the list of the tuples of the number,
+    the path, and the exception of the files failed.
+    """
+    def __init__(self):
+        self.extracted = []
+        self.errors = []
+
+def decode_name(zi, encoding="auto", normalize=None):
+    """
+    return the filename of zi decoded in encoding, and normalized if
+    normalize is one of valid_unicode_normalize_options.
+    note that "auto" decides the encoding for each name.  see Archive
+    to decide it for the whole zip file.
+    """
+    c_fname = decode_filename(zi, encoding)
+    if normalize:
+        import unicodedata
+        c_fname = unicodedata.normalize(normalize, c_fname)
+    return c_fname
+
+def make_member(number, zi, c_fname, normalize=None, dest_dir=None):
+    # normalize
+    if normalize:
+        # unicodedata is imported only when the normalization is required.
+        import unicodedata
+        c_fname = unicodedata.normalize(normalize, c_fname)
+    # separate the filename and the path.
+    # c_fname includes both.
+    # add dest_dir into the path if specified.
+    if c_fname is not None:
+        dname, fname = ospath.split(c_fname)
+        if dest_dir is not None:
+            dname = ospath.join(dest_dir, dname)
+    else:
+        raise ValueError("ERROR: c_fname is None")
+    if dest_dir is None and dname.startswith("/"):
+        raise ValueError("ERROR: c_fname started by a slash "
+                         "is not allowed. use the --dest-dir option.")
+    return Member(number, zi, c_fname, dname, ospath.join(dname, fname))
+
+class Archive:
+    """
+    a zip file to be listed or extracted.  the filenames are decoded for
+    the whole zip file when it is opened.  zip_file is the path or
+    a RangedFile.  index_cache is an IndexCache to take the central
+    directory from, or None.  it is not used for a RangedFile.
+    stats is a Stats to take the time of each phase, or None.
+    """
+    def __init__(self, zip_file, encoding="auto", password=None,
+                 index_cache=None, stats=None):
+        self.zip_file = zip_file
+        self.password = password
+        self.stats = stats
+        index_key = None
+        index = None
+        if stats is not None:
+            t0 = perf_counter()
+        if isinstance(zip_file, RangedFile):
+            index_cache = None
+        if index_cache is not None:
+            index_key, index = index_cache.load(zip_file)
+        index_modified = index is None
+        self.z = IndexedZipFile(zip_file, index=index)
+        if stats is not None:
+            stats.add_phase("open", perf_counter() - t0)
+        try:
+            if password:
+                self.z.setpassword(bytes(password, "ascii"))
+            if index is None:
+                index = make_index(self.z)
+            encoding_key = str(encoding)
+            if encoding_key not in index["names"]:
+                if stats is not None:
+                    t0 = perf_counter()
+                index["names"][encoding_key] = decode_filenames(
+                        self.z.infolist(), encoding)
+                if stats is not None:
+                    stats.add_phase("decode", perf_counter() - t0)
+                index_modified = True
+            if index_cache is not None and index_modified:
+                index_cache.store(zip_file, index_key, index)
+        except:
+            self.z.close()
+            raise
+        self.index = index
+        self.filenames, self.encoding_report = index["names"][encoding_key]
+        # the ZipFile to decrypt the members, opened on demand.
+        self._decrypter = None
+        self._indexes = {IndexedZipFile: index}
+        # each worker has its own ZipFile handles.
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._zipfiles = []
+        self._buffer_size = DEFAULT_BUFFER_SIZE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for z in self._zipfiles:
+            z.close()
+        self._zipfiles = []
+        if self._decrypter is not None:
+            self._decrypter.close()
+            self._decrypter = None
+        self.z.close()
+
+    def infolist(self):
+        return self.z.infolist()
+
+    def members(self, normalize=None, dest_dir=None):
         """
-        get the filename including the path.
-        Because zipfile.py converts the filename as it was cp437
-        when flag_bits doesn't have utf-8 bit (0x800).
-        The problem is Windows OS put the filename into the zip file
-        as it is.  And, in Japan, it uses Shift_JIS (cp932) Usually.
-        So, zipfile.py should converts with cp932 in that case.
-        The strategy here is that:
-            TBD...
+        generate all members in the zip file in order.
         """
-        if opt.filename_encoding is None:
-            c_fname = zi.filename
-        elif opt.filename_encoding == "auto":
-            if zi.flag_bits & 0x800:
-                c_fname = zi.filename
-            else:
-                """
-                some zip software (e.g. mac) doesn't set utf-8 bit even when
-                the encoding of the filename was in utf-8.
-                So, firstly here try to decode cp932, then try to decode utf-8.
-                """
+        for i, zi in enumerate(self.z.infolist()):
+            yield make_member(i + 1, zi, self.filenames[i], normalize,
+                              dest_dir)
+
+    def _open_zipfile(self, cls, index=None):
+        # a RangedFile is cloned to have its own position.
+        if isinstance(self.zip_file, RangedFile):
+            return cls(self.zip_file.clone(), index=index)
+        return cls(self.zip_file, index=index)
+
+    def _open_member(self, m):
+        """
+        return the class of ZipFile, the ZipFile, and the ZipInfo to
+        extract m.  an encrypted member is read by pyzipper, which is
+        loaded when the first one is met.
+        """
+        if not m.zipinfo.flag_bits & 0x1:
+            return IndexedZipFile, self.z, m.zipinfo
+        if self._decrypter is None:
+            cls = load_aes_zipfile()
+            z = self._open_zipfile(cls)
+            if self.password:
+                z.setpassword(bytes(self.password, "ascii"))
+            self._decrypter = z
+            self._indexes[cls] = make_index(z)
+        z = self._decrypter
+        return type(z), z, z.infolist()[m.number - 1]
+
+    def _worker_context(self, cls):
+        """
+        return a ZipFile handle of cls and a buffer dedicated to
+        the current worker.  the file pointer of a ZipFile can't be shared
+        among the workers.
+        """
+        ctx = self._local.__dict__
+        if "buf" not in ctx:
+            ctx["buf"] = bytearray(self._buffer_size)
+        if cls not in ctx:
+            # the central directory has been read by the main thread.
+            z = self._open_zipfile(cls, self._indexes[cls])
+            if self.password:
+                z.setpassword(bytes(self.password, "ascii"))
+            ctx[cls] = z
+            with self._lock:
+                self._zipfiles.append(z)
+        return ctx[cls], ctx["buf"]
+
+    def _extract_worker(self, cls, zi, fpath, writer):
+        z, buf = self._worker_context(cls)
+        return extract_file(z, zi, fpath, buf, self.stats, writer)
+
+    def extract_members(self, members, recursive=True, jobs=1,
+                        buffer_size=DEFAULT_BUFFER_SIZE, quiet=True,
+                        io_jobs=0, io_queue_size=DEFAULT_IO_QUEUE_SIZE,
+                        sync="none", restore=False):
+        """
+        extract members, an iterable of Member, and return ExtractResult.
+        with jobs more than 1, the files are extracted by a pool of
+        the workers.  the directories are created in the calling thread,
+        and the messages are printed in the order of members.
+        otherwise, it stops at the first error.
+        io_jobs, io_queue_size, sync, and restore are passed to FileWriter.
+        the files written behind are reported after all members are
+        decompressed.
+        """
+        result = ExtractResult()
+        writer = None
+        if io_jobs > 0 or sync != "none" or restore:
+            writer = FileWriter(io_jobs, io_queue_size, sync, restore,
+                                self.stats)
+        tasks = []
+        try:
+            if jobs > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                self._buffer_size = buffer_size
+                with ThreadPoolExecutor(max_workers=jobs) as pool:
+                    try:
+                        for m in members:
+                            tasks.append(self._submit(pool, m, recursive,
+                                                      quiet, writer))
+                    finally:
+                        self._wait(tasks, result, quiet)
+                return result
+            buf = bytearray(buffer_size)
+            for m in members:
+                future = None
                 try:
-                    c_fname = zi.filename.encode("cp437").decode("utf-8")
-                except:
-                    c_fname = zi.filename.encode("cp437").decode("cp932")
+                    _, z, zi = self._open_member(m)
+                    check_compression(zi)
+                    make_dest_dir(m.dirname, recursive, quiet)
+                    # extract the file
+                    if not zi.is_dir():
+                        future = extract_file(z, zi, m.path, buf,
+                                              self.stats, writer)
+                except Exception as e:
+                    tasks.append((m, None, e))
+                    break
+                if future is not None or tasks:
+                    # keep the order of the messages.
+                    tasks.append((m, future, None))
+                    continue
+                result.extracted.append((m.number, m.path))
+                if not quiet:
+                    print("extract {} into {}".format(m.number, m.path))
+            self._wait(tasks, result, quiet)
+            return result
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _submit(self, pool, m, recursive, quiet, writer):
+        try:
+            cls, _, zi = self._open_member(m)
+            check_compression(zi)
+            make_dest_dir(m.dirname, recursive, quiet)
+        except Exception as e:
+            return m, None, e
+        if zi.is_dir():
+            return m, None, None
+        return m, pool.submit(self._extract_worker, cls, zi, m.path,
+                              writer), None
+
+    def _wait(self, tasks, result, quiet):
+        # wait for all files submitted in the order of the zip file.
+        for m, future, error in tasks:
+            if future is not None:
+                try:
+                    # a worker returns the future of the writing behind.
+                    future = future.result()
+                    if future is not None:
+                        future.result()
+                except Exception as e:
+                    error = e
+            if error is not None:
+                result.errors.append((m.number, m.path, error))
+                continue
+            result.extracted.append((m.number, m.path))
+            if not quiet:
+                print("extract {} into {}".format(m.number, m.path))
+
+def make_selector(numbers=None, ex_files=(), excluding_files=()):
+    """
+    make a TargetSelector.  numbers is a string like "2,100-5000".
+    ex_files and excluding_files are the lists of the patterns.
+    """
+    return TargetSelector(NumberSet(numbers), list(excluding_files),
+                          list(ex_files))
+
+def iter_members(zip_file, encoding="auto", normalize=None, dest_dir=None,
+                 selector=None, password=None, index_cache=None):
+    """
+    generate the members of zip_file selected by selector, which is
+    a TargetSelector, with the filenames decoded.
+    all members are generated if selector is None.
+    """
+    with Archive(zip_file, encoding, password, index_cache) as archive:
+        for m in archive.members(normalize, dest_dir):
+            if selector is None or selector.match(m.number, m.filename):
+                yield m
+
+def extract(zip_file, ex_files=(), excluding_files=(), numbers=None,
+            dest_dir=None, encoding="auto", normalize=None, password=None,
+            recursive=True, jobs=1, buffer_size=DEFAULT_BUFFER_SIZE,
+            index_cache=None, quiet=True, io_jobs=0,
+            io_queue_size=DEFAULT_IO_QUEUE_SIZE, sync="none", restore=False):
+    """
+    extract the files selected from zip_file, and return ExtractResult.
+    UnzipxError is raised if a file selected is encrypted and password
+    is not specified.  see Archive.extract_members() for io_jobs,
+    io_queue_size, sync, and restore.
+    """
+    selector = make_selector(numbers, ex_files, excluding_files)
+    with Archive(zip_file, encoding, password, index_cache) as archive:
+        def selected():
+            for m in archive.members(normalize, dest_dir):
+                if not selector.match(m.number, m.filename):
+                    continue
+                if (m.zipinfo.flag_bits & 0x1) and password is None:
+                    raise UnzipxError("password required. "
+                                      f"{m.filename} is encrypted.")
+                yield m
+        return archive.extract_members(selected(), recursive=recursive,
+                                       jobs=jobs, buffer_size=buffer_size,
+                                       quiet=quiet, io_jobs=io_jobs,
+                                       io_queue_size=io_queue_size,
+                                       sync=sync, restore=restore)
+
+def print_debug(zi, c_fname):
+    print(f"filename: {c_fname}")
+    print(f"  compress_size : {zi.compress_size}")
+    print(f"  compress_type : {zi.compress_type}")
+    print(f"  comment : {zi.comment}")
+    print(f"  create_system : {zi.create_system}")
+    print(f"  create_version: {zi.create_version}")
+    print(f"  external_attr : {zi.external_attr}")
+    print(f"  extra : {zi.extra}")
+    print(f"  extract_version : {zi.extract_version}")
+    print(f"  flag_bits     : {zi.flag_bits}")
+    print("    utf-8: {}".format("yes" if zi.flag_bits & 0x800
+                                else "no"))
+    print(f"  header_offset : {zi.header_offset}")
+    print(f"  internal_attr : {zi.internal_attr}")
+    print(f"  zi.filename   : {zi.filename}")
+    print(f"  zi.orig       : {zi.orig_filename}")
+    """
+    if the flag has utf-8 bit, ZipFile reads the filename as utf-8.
+    otherwise, it reads as cp437.
+    """
+    if zi.flag_bits & 0x800:
+        print("    {}".format(
+                bytes(zi.filename, encoding="utf-8")))
+    else:
+        print("    {}".format(
+                bytes(zi.filename, encoding="cp437")))
+    print(f"  volume        : {zi.volume}")
+
+# the formats of the list of the files.
+valid_list_formats = ["text", "tsv", "json"]
+
+def pack_date_time(date_time):
+    # YYYYMMDDhhmmss as an integer.
+    x = 0
+    for v in date_time:
+        x = x * 100 + v
+    return x
+
+def unpack_date_time(x):
+    x, sec = divmod(x, 100)
+    x, minute = divmod(x, 100)
+    x, hour = divmod(x, 100)
+    x, day = divmod(x, 100)
+    year, month = divmod(x, 100)
+    return year, month, day, hour, minute, sec
+
+class FileTable:
+    """
+    the files listed, kept in the arrays instead of an object for each
+    file, to be passed from a worker in the batch mode.
+    """
+    __slots__ = ("numbers", "sizes", "times", "paths")
+
+    def __init__(self):
+        self.numbers = array("q")
+        self.sizes = array("q")
+        self.times = array("q")
+        self.paths = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def start(self, infolist):
+        pass
+
+    def append(self, number, size, date_time, path):
+        self.numbers.append(number)
+        self.sizes.append(size)
+        self.times.append(pack_date_time(date_time))
+        self.paths.append(path)
+
+    def __iter__(self):
+        for number, size, x, path in zip(self.numbers, self.sizes,
+                                         self.times, self.paths):
+            yield number, size, unpack_date_time(x), path
+
+class FileListing:
+    """
+    print the files listed one by one in fmt, one of valid_list_formats,
+    without keeping them.  the widths of the columns of the text format
+    are decided by the central directory before the first file is printed.
+    "json" prints a JSON object in a line.
+    """
+    def __init__(self, fmt="text", fd=None):
+        self.fmt = fmt
+        self.fd = fd
+        self.count = 0
+        self.w_number = 4
+        self.w_size = len("Length") + 2
+        # the date and time formatted, as many files share them.
+        self._dates = {}
+        if fmt == "json":
+            import json
+            self._dumps = json.dumps
+
+    def __len__(self):
+        return self.count
+
+    def start(self, infolist):
+        if infolist:
+            self.set_widths(len(infolist),
+                            max(zi.file_size for zi in infolist))
+
+    def set_widths(self, max_number, max_size):
+        self.w_number = max(4, len(str(max_number)))
+        self.w_size = max(len("Length"), len(str(max_size))) + 2
+
+    def format_date_time(self, date_time):
+        x = self._dates.get(date_time)
+        if x is not None:
+            return x
+        date = f"{date_time[0]:04}-{date_time[1]:02}-{date_time[2]:02}"
+        if self.fmt == "text":
+            x = f"{date} {date_time[3]:02}:{date_time[4]:02}"
         else:
-            """
-            if flag_bits has 0x800, zipfile.py converted with utf-8.
-            so, here needs to back conversion by utf-8,
-            then convert it with one specified.
-            if not, zipfile.py uses cp437 as well.
-            """
-            if zi.flag_bits & 0x800:
-                c_fname = zi.filename.encode("utf-8").decode(opt.filename_encoding)
-            else:
-                c_fname = zi.filename.encode("cp437").decode(opt.filename_encoding)
-        # normalize
-        if opt.unicode_normalize:
-            c_fname = unicodedata.normalize(opt.unicode_normalize,
-                                                   c_fname)
-        # separate the filename and the path.
-        # c_fname includes both.
-        # add dest_dir into the path if specified.
-        if c_fname is not None:
-            dname, fname = ospath.split(c_fname)
-            if opt.dest_dir is not None:
-                dname = ospath.join(opt.dest_dir, dname)
+            x = f"{date}T{date_time[3]:02}:{date_time[4]:02}:{date_time[5]:02}"
+        if len(self._dates) >= 4096:
+            self._dates.clear()
+        self._dates[date_time] = x
+        return x
+
+    def append(self, number, size, date_time, path):
+        if self.count == 0:
+            self.print_header()
+        self.count += 1
+        dt = self.format_date_time(date_time)
+        if self.fmt == "text":
+            print(f"{number:>{self.w_number}} {size:>{self.w_size}} {dt} "
+                  f"{path}", file=self.fd)
+        elif self.fmt == "tsv":
+            if "\t" in path or "\n" in path or "\\" in path:
+                path = (path.replace("\\", "\\\\").replace("\t", "\\t")
+                        .replace("\n", "\\n"))
+            print(f"{number}\t{size}\t{dt}\t{path}", file=self.fd)
         else:
-            raise ValueError("ERROR: c_fname is None")
-        if opt.dest_dir is None and dname.startswith("/"):
-            raise ValueError("ERROR: c_fname started by a slash "
-                             "is not allowed. use the --dest-dir option.")
-        fpath = ospath.join(dname, fname)
-
-        if is_target_file(n, c_fname) and opt.debug:
-            print(f"filename: {c_fname}")
-            print(f"  compress_size : {zi.compress_size}")
-            print(f"  compress_type : {zi.compress_type}")
-            print(f"  comment : {zi.comment}")
-            print(f"  create_system : {zi.create_system}")
-            print(f"  create_version: {zi.create_version}")
-            print(f"  external_attr : {zi.external_attr}")
-            print(f"  extra : {zi.extra}")
-            print(f"  extract_version : {zi.extract_version}")
-            print(f"  flag_bits     : {zi.flag_bits}")
-            print("    utf-8: {}".format("yes" if zi.flag_bits & 0x800
-                                        else "no"))
-            print(f"  header_offset : {zi.header_offset}")
-            print(f"  internal_attr : {zi.internal_attr}")
-            print(f"  zi.filename   : {zi.filename}")
-            print(f"  zi.orig       : {zi.orig_filename}")
-            """
-            if the flag has utf-8 bit, ZipFile reads the filename as utf-8.
-            otherwise, it reads as cp437.
-            """
-            if zi.flag_bits & 0x800:
-                print("    {}".format(
-                        bytes(zi.filename, encoding="utf-8")))
+            name = self._dumps(path, ensure_ascii=False)
+            print(f'{{"number": {number}, "length": {size}, '
+                  f'"date_time": "{dt}", "name": {name}}}', file=self.fd)
+
+    def print_header(self):
+        if self.fmt == "text":
+            h = [ "#", "Length", "Date", "Time", "Name" ]
+            print(f"{h[0].rjust(self.w_number)} {h[1].rjust(self.w_size)} "
+                  f"{h[2].center(10)} {h[3].ljust(5)} {h[4]}", file=self.fd)
+            print(f"{'-'*self.w_number} {'-'*self.w_size} {'-'*10} "
+                  f"{'-'*5} {'-'*4}", file=self.fd)
+        elif self.fmt == "tsv":
+            print("number\tlength\tdate_time\tname", file=self.fd)
+
+def print_file_info(file_info):
+    """
+    print FileTable in the text format.
+    """
+    listing = FileListing()
+    listing.set_widths(max(file_info.numbers), max(file_info.sizes))
+    for x in file_info:
+        listing.append(*x)
+
+def process_archive(opt, target_selector, index_cache, zip_file, dest_dir,
+                    file_info, stats=None):
+    """
+    list or extract zip_file as the command line specifies.
+    in the list mode, the files selected are added to file_info,
+    a FileListing or a FileTable.  return ExtractResult in the extract
+    mode, otherwise None.
+    """
+    def selected(archive):
+        for m in archive.members(opt.unicode_normalize, dest_dir):
+            zi = m.zipinfo
+            if stats is None:
+                is_target = target_selector.match(m.number, m.filename)
             else:
-                print("    {}".format(
-                        bytes(zi.filename, encoding="cp437")))
-            print(f"  volume        : {zi.volume}")
+                t0 = perf_counter()
+                is_target = target_selector.match(m.number, m.filename)
+                stats.add_phase("select", perf_counter() - t0)
+            if is_target and opt.debug:
+                print_debug(zi, m.filename)
+            # check whether encrypted.
+            if (zi.flag_bits & 0x1) and opt.password is None:
+                # XXX how to know if the password is encoded as utf-8 or not.
+                raise UnzipxError("password required. "
+                                  f"{m.filename} is encrypted.")
+            if is_target:
+                if not opt.extract_mode:
+                    file_info.append(m.number, zi.file_size, zi.date_time,
+                                     m.path)
+                yield m
 
-        # check whether encrypted.
-        if (zi.flag_bits & 0x1) and opt.password is None:
-            # XXX how to know if the password is encoded as utf-8 or not.
-            print("ERROR: password required. {} is encrypted.".format(c_fname))
-            exit(1)
+    if is_url(zip_file):
+        zip_file = open_url(zip_file, block_size=opt.block_size*1024,
+                            cache_size=opt.cache_size*1024*1024,
+                            read_ahead=opt.read_ahead, stats=stats)
+    with Archive(zip_file, opt.filename_encoding, opt.password,
+                 index_cache, stats) as archive:
+        if opt.encoding_report:
+            print_encoding_report(archive.encoding_report,
+                                  opt.filename_encoding)
+        if not opt.extract_mode:
+            file_info.start(archive.infolist())
+            for m in selected(archive):
+                pass
+            return None
+        return archive.extract_members(
+                selected(archive), recursive=opt.recursive, jobs=opt.jobs,
+                buffer_size=opt.buffer_size, quiet=opt.quiet,
+                io_jobs=opt.io_jobs, io_queue_size=opt.io_queue_size,
+                sync=opt.sync, restore=opt.restore)
 
-        if is_target_file(n, c_fname):
+def load_archive_list(archive_list):
+    """
+    read the zip files from archive_list, one file in a line.
+    "-" means the standard input.
+    """
+    if archive_list == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(archive_list, encoding="utf-8") as fd:
+            lines = fd.read().splitlines()
+    return [x for x in lines if x and not x.startswith("#")]
 
-            # extract if needed.
-            if opt.extract_mode:
-                try:
-                    do_extract(z, zi, dname, fpath)
-                except Exception as e:
-                    break
+def batch_dest_dir(template, index, zip_file):
+    """
+    make the directory for zip_file in the batch mode from template.
+    """
+    if template is None:
+        template = "{name}"
+    elif "{" not in template:
+        template = ospath.join(template, "{name}")
+    name = ospath.splitext(ospath.basename(zip_file))[0]
+    parent = ospath.basename(ospath.dirname(ospath.abspath(zip_file)))
+    return template.format(name=name, index=index, parent=parent)
+
+# the settings of a batch worker process.
+batch_context = {}
+
+def init_batch_worker(opt):
+    # the patterns are compiled once in each process.
+    batch_context["opt"] = opt
+    batch_context["selector"] = TargetSelector(
+            NumberSet(opt.file_number), opt.excluding_files, opt.ex_files)
+    batch_context["index_cache"] = None
+    if opt.index_cache:
+        batch_context["index_cache"] = IndexCache(
+                opt.index_cache, opt.index_cache_size*1024*1024)
+
+def batch_worker(task):
+    """
+    process a zip file in a worker process.  the output is returned
+    instead of being printed so that it is not mixed with others.
+    return a tuple of the zip file, the directory, the status,
+    the number of the files, the message, and file_info.
+    """
+    index, zip_file = task
+    opt = batch_context["opt"]
+    dest_dir = batch_dest_dir(opt.dest_dir, index, zip_file)
+    file_info = FileTable()
+    try:
+        result = process_archive(opt, batch_context["selector"],
+                                 batch_context["index_cache"], zip_file,
+                                 dest_dir if opt.extract_mode else None,
+                                 file_info)
+    except Exception as e:
+        return zip_file, dest_dir, "FAILED", 0, str(e), None
+    if result is None:
+        return zip_file, dest_dir, "OK", len(file_info), "", file_info
+    if result.errors:
+        x = result.errors[0]
+        return (zip_file, dest_dir, "FAILED", len(result.extracted),
+                f"failed to extract {x[0]} into {x[1]}: {x[2]}", None)
+    return zip_file, dest_dir, "OK", len(result.extracted), "", None
+
+def run_batch(opt, archives):
+    """
+    process the zip files by a pool of the processes, and print
+    the status of each zip file and the summary.
+    the messages of each file extracted are not printed.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    opt.quiet = True
+    nb_jobs = opt.batch_jobs or cpu_count() or 1
+    nb_jobs = max(1, min(nb_jobs, len(archives)))
+    # small zip files are passed to the workers in chunks.
+    chunksize = max(1, min(64, len(archives) // (nb_jobs*4)))
+    tasks = enumerate(archives, 1)
+    nb_ok = 0
+    nb_files = 0
+    failed = []
+    if nb_jobs == 1:
+        init_batch_worker(opt)
+        results = map(batch_worker, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=nb_jobs,
+                                   initializer=init_batch_worker,
+                                   initargs=(opt,))
+        results = pool.map(batch_worker, tasks, chunksize=chunksize)
+    try:
+        for zip_file, dest_dir, status, count, message, file_info in results:
+            nb_files += count
+            if status == "OK":
+                nb_ok += 1
+            else:
+                failed.append((zip_file, message))
+            if message:
+                print(f"{zip_file}: {status} {message}")
+            elif not opt.extract_mode:
+                print(f"{zip_file}: {status} {count} files")
+                if file_info:
+                    print_file_info(file_info)
+            else:
+                print(f"{zip_file}: {status} {count} files into {dest_dir}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print(f"batch: {len(archives)} zip files, {nb_ok} ok, "
+          f"{len(failed)} failed, {nb_files} files.")
+    for zip_file, message in failed:
+        print(f"ERROR: {zip_file}: {message}")
+    return 1 if failed else 0
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(
+            description="unzip helper to extract non utf-8 files.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    ap.add_argument("zip_file", nargs="?",
+                    help="""specify a zipped file.  a URL of http or https
+                    is read by the range requests.""")
+    ap.add_argument("ex_files", nargs="*",
+                    help="""specify files (regex acceptable) to be extracted.
+                    they are the zip files in the batch mode.""")
+    ap.add_argument("--prefix", action="store", dest="prefix", default="",
+                    help="specify a prefix.")
+    ap.add_argument("-i", action="store", dest="file_number",
+                    help="""specify a file number or list to be extracted.
+                    e.g. -i 2, -i 2,3, or -i 2,100-5000 (1 origin)
+                    """)
+    ap.add_argument("-p", "--password", action="store", dest="password",
+                    help="specify the password for the zipped file.")
+    ap.add_argument("-x", action="store_true", dest="extract_mode",
+                    help="extract the contents.  default is to list the files.")
+    ap.add_argument("-e", action="append", dest="excluding_files", default=[],
+                    help="specify a file name (regex acceptable) to be ignored."
+                    "This option can be specified in multiple.")
+    ap.add_argument("-@", action="append", dest="rule_files", default=[],
+                    help="""specify a file of the patterns (regex acceptable),
+                    one pattern in a line.  a pattern starting with "!" is
+                    the one to be ignored.  "-" means the standard input.
+                    This option can be specified in multiple.""")
+    ap.add_argument("-E", "--encoding", action="store", dest="filename_encoding",
+                    default="auto",
+                    help="""specify a filename encoding in the zip file.
+                    e.g. cp932, utf-8.  default is cp932.""")
+    ap.add_argument("--format", action="store", dest="list_format",
+                    default="text", choices=valid_list_formats,
+                    help="""specify the format of the list of the files.
+                    json prints a JSON object for each file in a line.""")
+    ap.add_argument("--encoding-report", action="store_true",
+                    dest="encoding_report",
+                    help="show the encoding of the filenames detected.")
+    ap.add_argument("--no-convertion", action="store_false", dest="conversion",
+                    help="disable to convert the filename.")
+    ap.add_argument("-D", "--dest-dir", action="store", dest="dest_dir",
+                    help="""specify a directory to store the files extracted.
+                    in the batch mode, it is a template of the directory
+                    for each zip file.  {name} is replaced with the name
+                    of the zip file without the extension, {index} with
+                    the number of the zip file, and {parent} with the name
+                    of the directory of the zip file.  {name} is appended
+                    if no placeholder is included.""")
+    ap.add_argument("-R", action="store_false", dest="recursive",
+                    help="""extract only the 1st level of files,
+                    not including the sub directories.""")
+    ap.add_argument("-n", "--normalize", action="store", dest="unicode_normalize",
+                    help=f"""specify a string for normalization of the filename.
+                    valid string are {valid_unicode_normalize_options}""")
+    ap.add_argument("--index-cache", action="store", dest="index_cache",
+                    help="""specify a directory to cache the index of
+                    the zip file.  the index is used to list and extract
+                    the files next time.""")
+    ap.add_argument("--index-cache-size", action="store",
+                    dest="index_cache_size", type=int, default=256,
+                    help="specify the max size of the index cache in MB.")
+    ap.add_argument("--block-size", action="store", dest="block_size",
+                    type=int, default=256,
+                    help="""specify the size of the block in KB to read
+                    a zip file of a URL.""")
+    ap.add_argument("--cache-size", action="store", dest="cache_size",
+                    type=int, default=64,
+                    help="""specify the size of the cache of the blocks in
+                    MB to read a zip file of a URL.""")
+    ap.add_argument("--read-ahead", action="store", dest="read_ahead",
+                    type=int, default=16,
+                    help="""specify the max number of the blocks read at
+                    once while a zip file of a URL is read sequentially.""")
+    ap.add_argument("--buffer-size", action="store", dest="buffer_size",
+                    type=int, default=DEFAULT_BUFFER_SIZE,
+                    help="specify the size of the buffer in bytes to extract.")
+    ap.add_argument("-j", "--jobs", action="store", dest="jobs",
+                    type=int, default=1,
+                    help="specify the number of workers to extract the files.")
+    ap.add_argument("--io-jobs", action="store", dest="io_jobs",
+                    type=int, default=0,
+                    help="""specify the number of the I/O threads to write
+                    the files behind the decompression.  the files up to
+                    the buffer size are written behind.  0 means to write
+                    them by the workers to extract.""")
+    ap.add_argument("--io-queue-size", action="store", dest="io_queue_size",
+                    type=int, default=DEFAULT_IO_QUEUE_SIZE,
+                    help="""specify the max number of the files held in
+                    memory to be written behind.""")
+    ap.add_argument("--sync", action="store", dest="sync", default="none",
+                    choices=valid_sync_options,
+                    help="""specify the durability of the files extracted.
+                    file syncs each file before closing it, and batch syncs
+                    the files extracted and their directories once at
+                    the end.""")
+    ap.add_argument("--restore-attributes", action="store_true",
+                    dest="restore",
+                    help="""restore the mtime and the permissions of
+                    the files extracted.""")
+    ap.add_argument("--batch", action="store_true", dest="batch",
+                    help="""treat all arguments as the zip files, and
+                    process them by a pool of the processes.  the files to
+                    be extracted can be specified by the -@ option.""")
+    ap.add_argument("--archive-list", action="append", dest="archive_lists",
+                    default=[],
+                    help="""specify a file of the zip files to be processed
+                    in the batch mode, one file in a line.  "-" means
+                    the standard input.
+                    This option can be specified in multiple.""")
+    ap.add_argument("--batch-jobs", action="store", dest="batch_jobs",
+                    type=int, default=0,
+                    help="""specify the number of processes in the batch
+                    mode.  0 means the number of the CPUs.""")
+    ap.add_argument("--stats", action="store_true", dest="stats",
+                    help="""show the time of each phase, the throughput of
+                    each compression method, and the slowest files.""")
+    ap.add_argument("--stats-json", action="store", dest="stats_json",
+                    help="""specify a file to write the stats in JSON.
+                    "-" means the standard output.""")
+    ap.add_argument("--stats-top", action="store", dest="stats_top",
+                    type=int, default=10,
+                    help="specify the number of the slowest files shown.")
+    ap.add_argument("--profile", action="store", dest="profile",
+                    help="""specify a file to write the profile taken by
+                    cProfile.  the workers in the batch mode are not
+                    profiled.""")
+    ap.add_argument("-q", "--quiet", action="store_true", dest="quiet",
+                    help="enable quiet mode.")
+    ap.add_argument("-d", action="store_true", dest="debug",
+                    help="enable debug mode.")
+    opt = ap.parse_args(argv)
+
+    if opt.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run, ap, opt)
+        finally:
+            profiler.dump_stats(opt.profile)
+    return run(ap, opt)
+
+def run(ap, opt):
+    """
+    list or extract the files as opt, the command line parsed by ap,
+    specifies.  return the exit status.
+    """
+
+    # filename encoding
+    if not opt.conversion:
+        opt.filename_encoding = None
+
+    # make the list for extracting.
+    try:
+        extract_file_number_list = NumberSet(opt.file_number)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        ap.print_help()
+        return 1
+    if extract_file_number_list and not opt.extract_mode:
+        print("ERROR: the -x option is required when the -i option is used.")
+        return 1
+
+    if opt.buffer_size <= 0:
+        print("ERROR: the buffer size must be a positive number.")
+        return 1
+    if opt.block_size <= 0 or opt.cache_size <= 0 or opt.read_ahead <= 0:
+        print("ERROR: the block size, the cache size, and the read ahead "
+              "must be positive numbers.")
+        return 1
+    if opt.jobs < 1:
+        print("ERROR: the number of jobs must be a positive number.")
+        return 1
+    if opt.io_jobs < 0 or opt.io_queue_size < 1:
+        print("ERROR: the number of the I/O threads must not be negative, "
+              "and the queue size must be a positive number.")
+        return 1
+    if opt.batch_jobs < 0:
+        print("ERROR: the number of processes must not be negative.")
+        return 1
+
+    # make the list of the zip files in the batch mode.
+    archives = None
+    if opt.batch or opt.archive_lists:
+        archives = []
+        if opt.batch:
+            if opt.zip_file:
+                archives.append(opt.zip_file)
+            archives.extend(opt.ex_files)
+            opt.ex_files = []
+        elif opt.zip_file:
+            print("ERROR: use the --batch option to specify the zip files "
+                  "with the --archive-list option.")
+            return 1
+        for archive_list in opt.archive_lists:
+            archives.extend(load_archive_list(archive_list))
+    elif not opt.zip_file:
+        print("ERROR: the zip file is required.")
+        ap.print_help()
+        return 1
+
+    for rule_file in opt.rule_files:
+        excluding_files, ex_files = load_rules(rule_file)
+        opt.excluding_files.extend(excluding_files)
+        opt.ex_files.extend(ex_files)
+    try:
+        target_selector = TargetSelector(extract_file_number_list,
+                                         opt.excluding_files, opt.ex_files)
+    except re.error as e:
+        print(f"ERROR: invalid pattern, {e}")
+        return 1
+
+    stats = None
+    if opt.stats or opt.stats_json:
+        if archives is not None:
+            print("ERROR: the --stats option can't be used in the batch mode.")
+            return 1
+        stats = Stats(opt.stats_top)
+
+    index_cache = None
+    if opt.index_cache:
+        # checked before the batch workers make it as well.
+        try:
+            index_cache = IndexCache(opt.index_cache,
+                                     opt.index_cache_size*1024*1024)
+        except UnzipxError as e:
+            print(f"ERROR: {e}")
+            return 1
+
+    if archives is not None:
+        if opt.list_format != "text":
+            print("ERROR: the --format option can't be used in "
+                  "the batch mode.")
+            return 1
+        return run_batch(opt, archives)
+
+    file_info = FileListing(opt.list_format)
+    status = 0
+    try:
+        result = process_archive(opt, target_selector, index_cache,
+                                 opt.zip_file, opt.dest_dir, file_info,
+                                 stats)
+    except UnzipxError as e:
+        print(f"ERROR: {e}")
+        status = 1
+    except BrokenPipeError:
+        # the reader of the list, e.g. head, has exited.  stdout is
+        # redirected not to fail again when it is flushed at the exit.
+        import os
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    else:
+        if result is not None:
+            for x in result.errors:
+                print(f"ERROR: failed to extract {x[0]} into {x[1]}: "
+                      f"{x[2]}")
+            if result.errors:
+                status = 1
+
+    if opt.stats:
+        stats.print_report()
+    if opt.stats_json:
+        stats.write_json(opt.stats_json)
+    return status
 
-            file_info.append([str(n), str(zi.file_size), zi.date_time, fpath])
-        #
-        n += 1
-
-    if not opt.extract_mode and file_info:
-        max_w0 = 4
-        h = [ "#", "Length", "Date", "Time", "Name" ]
-        max_w1 = max([len("Length"), max([len(x[1]) for x in file_info])]) + 2
-        print(f"{h[0].rjust(max_w0)} {h[1].rjust(max_w1)} {h[2].center(10)} {h[3].ljust(5)} {h[4]}")
-        print(f"{'-'*max_w0} {'-'*max_w1} {'-'*10} {'-'*5} {'-'*4}")
-        for x in file_info:
-            date = f"{x[2][0]:04}-{x[2][1]:02}-{x[2][2]:02}"
-            time = f"{x[2][3]:02}:{x[2][4]:02}"
-            print(f"{x[0].rjust(max_w0)} {x[1].rjust(max_w1)} {date} {time} {x[3]}")
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+the stats taken by the --stats option of zipx and unzipx.
+"""
+
+import sys
+import zipfile
+import threading
+from heapq import heappush, heappushpop
+from time import perf_counter
+
+# the names of the compression methods for --stats.
+compression_names = {
+    zipfile.ZIP_STORED: "stored",
+    zipfile.ZIP_DEFLATED: "deflate",
+    zipfile.ZIP_BZIP2: "bzip2",
+    zipfile.ZIP_LZMA: "lzma",
+    99: "aes",
+    }
+
+class Stats:
+    """
+    the timers and the counters taken by --stats.
+    the phases are the total seconds, the count, and the bytes.
+    the time of the workers is summed up, so that it can be longer than
+    the wall time with the -j option.
+    stats is None if --stats is not specified, and the hooks do nothing.
+    """
+    def __init__(self, top=10):
+        self.top = top
+        self.phases = {}
+        self.compressions = {}
+        self.slowest = []
+        self.started = perf_counter()
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, elapsed, nbytes=0):
+        with self._lock:
+            x = self.phases.setdefault(name, [0.0, 0, 0])
+            x[0] += elapsed
+            x[1] += 1
+            x[2] += nbytes
+
+    def add_member(self, zi, path, elapsed):
+        compression = compression_names.get(zi.compress_type,
+                                            str(zi.compress_type))
+        if zi.flag_bits & 0x1:
+            compression += "+encrypted"
+        with self._lock:
+            x = self.compressions.setdefault(compression, [0.0, 0, 0, 0])
+            x[0] += elapsed
+            x[1] += 1
+            x[2] += zi.file_size
+            x[3] += zi.compress_size
+            # keep the slowest ones in a heap.
+            item = (elapsed, path, zi.file_size)
+            if len(self.slowest) < self.top:
+                heappush(self.slowest, item)
+            else:
+                heappushpop(self.slowest, item)
+
+    def to_dict(self):
+        return {
+            "wall": perf_counter() - self.started,
+            "phases": {k: {"seconds": v[0], "count": v[1], "bytes": v[2]}
+                       for k, v in self.phases.items()},
+            "compressions": {
+                k: {"seconds": v[0], "count": v[1], "bytes": v[2],
+                    "compressed_bytes": v[3],
+                    "mb_per_s": v[2] / 1024 / 1024 / v[0] if v[0] else None}
+                for k, v in self.compressions.items()},
+            "slowest": [{"seconds": x[0], "path": x[1], "bytes": x[2]}
+                        for x in sorted(self.slowest, reverse=True)],
+            }
+
+    def print_report(self, fd=None):
+        # sys.stdout may be redirected after the import.
+        if fd is None:
+            fd = sys.stdout
+        d = self.to_dict()
+        print(f"stats: wall {d['wall']:.3f} sec", file=fd)
+        print(f"  {'phase':12} {'sec':>10} {'count':>9} {'bytes':>14}",
+              file=fd)
+        for name, x in d["phases"].items():
+            print(f"  {name:12} {x['seconds']:10.3f} {x['count']:9} "
+                  f"{x['bytes']:14}", file=fd)
+        for name, x in d["compressions"].items():
+            mbps = x["mb_per_s"]
+            print(f"  {name}: {x['count']} files, {x['bytes']} bytes "
+                  f"from {x['compressed_bytes']} bytes, "
+                  f"{x['seconds']:.3f} sec, "
+                  f"{'-' if mbps is None else f'{mbps:.1f}'} MB/s", file=fd)
+        if d["slowest"]:
+            print(f"  the slowest {len(d['slowest'])} files:", file=fd)
+        for x in d["slowest"]:
+            print(f"    {x['seconds']:8.3f} sec {x['bytes']:12} {x['path']}",
+                  file=fd)
+
+    def write_json(self, path):
+        import json
+        if path == "-":
+            json.dump(self.to_dict(), sys.stdout, indent=2)
+            print()
+            return
+        with open(path, "w", encoding="utf-8") as fd:
+            json.dump(self.to_dict(), fd, indent=2)
@@ -2,15 +2,35 @@
 
 import pyzipper as zipfile
 from pyzipper import AESZipFile as ZipFile
+from pyzipper.zipfile import _strip_extra, LargeZipFile
+from pyzipper.zipfile import ZIP64_VERSION, BZIP2_VERSION, LZMA_VERSION
+from pyzipper.zipfile import structEndArchive64, stringEndArchive64
+from pyzipper.zipfile import structEndArchive64Locator
+from pyzipper.zipfile import stringEndArchive64Locator
+from pyzipper.zipfile_aes import EXTRA_WZ_AES
 
-from os.path import exists
-from os import scandir, stat
+from os.path import exists, basename, normpath, splitdrive
+from os import scandir, stat, sep, altsep, replace, unlink
+from os import PathLike, fspath
 from stat import S_ISDIR
+from fnmatch import fnmatch
+from queue import Queue, Full
+from threading import Thread, Event
+from time import localtime, monotonic, perf_counter
+import sys
+from zlib import crc32, compress
+from hashlib import blake2b
 import unicodedata
 import shutil
+from collections import deque
+from contextlib import nullcontext, redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
 from argparse import ArgumentParser
 from argparse import ArgumentDefaultsHelpFormatter
 
+from zipstats import Stats, compression_names
+
 # for _write_end_record()
 import struct
 ZIP64_LIMIT = (1 << 31) - 1
@@ -22,20 +42,278 @@ structEndArchive = b"<4s4H2LH"
 stringEndArchive = b"PK\005\006"
 structCentralDir = "<4s4B4HL2L5H2L"
 stringCentralDir = b"PK\001\002"
+packCentralDir = struct.Struct(structCentralDir).pack
+# the central directory is written in chunks of this size.
+CENTDIR_BUFSIZE = 1024*1024
+
+# for the parallel compression.
+# a member compressed larger than SPOOL_SIZE is stored into a disk.
+SPOOL_SIZE = 16*1024*1024
+COPY_BUFSIZE = 1024*1024
 
 # normalization
 valid_unicode_normalize_options = ["NFC", "NFKC", "NFD", "NFKD"]
 
+class ProgressReporter:
+    """
+    print the progress of the work at most once in interval seconds,
+    and a summary at the end.  nothing is printed if not enabled.
+    """
+    def __init__(self, label, total, enabled=True, interval=1.0):
+        self.label = label
+        self.total = total
+        self.enabled = enabled
+        self.interval = interval
+        self.count = 0
+        self.last = monotonic()
+
+    def update(self, name):
+        self.count += 1
+        if not self.enabled:
+            return
+        now = monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            print(f"{self.label}: {self.count}/{self.total} {name}")
+
+    def done(self):
+        if self.enabled:
+            print(f"{self.label}: {self.count} files.")
+
+# the methods which can be specified by -Z.
+compression_methods = {v: k for k, v in compression_names.items()
+                       if v != "aes"}
+
+def timed_walk(walker, stats):
+    # take the time to wait for the files found by walker.
+    it = iter(walker)
+    while True:
+        t0 = perf_counter()
+        try:
+            x = next(it)
+        except StopIteration:
+            return
+        stats.add_phase("walk", perf_counter() - t0)
+        yield x
+
+class _StagedMember:
+    """
+    a stand-in of ZipFile for zipwritefile_cls.
+    it is used to write a local header and the compressed data of a member
+    into a temporary file without touching the archive.
+    """
+    def __init__(self):
+        self.fp = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.start_dir = 0
+        self._didModify = False
+        self._writing = False
+        self.filelist = []
+        self.NameToInfo = {}
+
+# the extensions of the files already compressed, which are stored.
+incompressible_extensions = [
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "avif",
+    "mp3", "m4a", "aac", "ogg", "opus", "flac",
+    "mp4", "m4v", "mov", "mkv", "webm", "avi",
+    "zip", "gz", "tgz", "bz2", "xz", "txz", "zst", "7z", "rar", "lz4",
+    "jar", "apk", "docx", "xlsx", "pptx", "odt", "epub", "pdf",
+    ]
+
+class CompressionPolicy:
+    """
+    choose the compression method of each file by the rules, a list of
+    the tuples of a pattern and a method, and the first rule matched is
+    applied.  a pattern is matched as match_patterns() does.
+    a method is a name in compression_names, "default" for the method of
+    the archive, or "auto" to try to compress the first block of the file.
+    the file is stored if the block doesn't shrink to ratio.
+    the files not matched are handled as "auto".
+    counts has the number of the files of each method chosen.
+    """
+    sample_size = 64*1024
+    ratio = 0.95
+
+    def __init__(self, rules=None):
+        if rules is None:
+            rules = [(f"*.{x}", "stored") for x in incompressible_extensions]
+        self.rules = []
+        for pattern, method in rules:
+            if method not in ("default", "auto", *compression_methods):
+                raise ZipxError(f"unknown compression method {method} "
+                                f"for {pattern}")
+            # the extensions are matched case-insensitively.
+            self.rules.append((pattern.lower(), method))
+        self.counts = {}
+
+    @classmethod
+    def load(cls, policy_file, defaults=True):
+        """
+        read the rules from policy_file, a pattern and a method separated
+        by spaces in a line.  an empty line and a line starting with "#"
+        are skipped.  the rules follow the default ones if defaults.
+        """
+        rules = []
+        try:
+            with open(policy_file, encoding="utf-8") as fd:
+                lines = fd.read().splitlines()
+        except OSError as e:
+            raise ZipxError(f"can't read {policy_file}: {e}")
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                pattern, method = line.rsplit(None, 1)
+            except ValueError:
+                raise ZipxError(f"invalid rule in {policy_file}: {line}")
+            rules.append((pattern, method))
+        if defaults:
+            rules += [(f"*.{x}", "stored") for x in incompressible_extensions]
+        return cls(rules)
+
+    def choose(self, filename, file_size, compression):
+        """
+        return the compression method for filename.
+        compression is the method of the archive.
+        """
+        method = "auto"
+        name = filename.lower()
+        for pattern, x in self.rules:
+            if match_patterns(name, [pattern]):
+                method = x
+                break
+        if method == "default":
+            compress_type = compression
+        elif method == "auto":
+            compress_type = compression
+            if (compression != zipfile.ZIP_STORED and
+                    not self.is_compressible(filename, file_size)):
+                compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = compression_methods[method]
+        self.counts[compress_type] = self.counts.get(compress_type, 0) + 1
+        return compress_type
+
+    def is_compressible(self, filename, file_size):
+        # a small file is compressed as it costs little.
+        if file_size < 4096:
+            return True
+        with open(filename, "rb") as fd:
+            sample = fd.read(self.sample_size)
+        if not sample:
+            return True
+        return len(compress(sample, 1)) < len(sample) * self.ratio
+
+class _DedupEntry:
+    """
+    a content of a file written into the archive, to be reused by
+    the files of the same content.  digest is computed when another file
+    of the same size is met.  data_offset is the offset of the compressed
+    data in the archive, which is set when it is written.  elapsed is
+    the time taken to compress it.
+    """
+    __slots__ = ("filename", "zinfo", "digest", "data_offset", "elapsed")
+
+    def __init__(self, filename, zinfo, digest=None):
+        self.filename = filename
+        self.zinfo = zinfo
+        self.digest = digest
+        self.data_offset = None
+        self.elapsed = 0.0
+
+def file_digest(filename):
+    h = blake2b()
+    with open(filename, "rb") as fd:
+        while True:
+            data = fd.read(COPY_BUFSIZE)
+            if not data:
+                return h.digest()
+            h.update(data)
+
+def zipinfo_from_stat(cls, filename, st, arcname=None):
+    """
+    same as ZipInfo.from_file() except that st is the result of stat()
+    of the filename taken in advance.
+    """
+    isdir = S_ISDIR(st.st_mode)
+    date_time = localtime(st.st_mtime)[0:6]
+    if arcname is None:
+        arcname = filename
+    arcname = normpath(splitdrive(arcname)[1])
+    while arcname[0] in (sep, altsep):
+        arcname = arcname[1:]
+    if isdir:
+        arcname += "/"
+    zinfo = cls(arcname, date_time)
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16  # Unix attributes
+    if isdir:
+        zinfo.file_size = 0
+        zinfo.external_attr |= 0x10  # MS-DOS directory flag
+    else:
+        zinfo.file_size = st.st_size
+    return zinfo
+
+class ZipInfoImproved(ZipFile.zipinfo_cls):
+    """
+    a ZipInfo of which the local header has the filename encoded in the same
+    way as the central directory.  encoded_name is a tuple of the filename
+    encoded and the flag bits for it, which is set by ZipFileImproved.
+    """
+    __slots__ = ("encoded_name",)
+
+    def _encodeFilenameFlags(self):
+        try:
+            filename, flag_bits = self.encoded_name
+        except AttributeError:
+            return super()._encodeFilenameFlags()
+        return filename, self.flag_bits | flag_bits
+
 class ZipFileImproved(ZipFile):
     """
     zipfile.py in Python 3.8
+
+    if jobs is more than 1, the members are compressed by a pool of
+    the workers, and written into the archive in the order of write().
+    if verbose, the progress of writing the central directory is printed.
+    stats is a Stats to take the time of each phase, or None.
+    if dedup, a file of the same content as the one written before is
+    not compressed again, and the compressed data is copied in the archive.
+    dedup_stats has the number of such files, their size, and the time
+    saved, and the bytes and the time to hash the files.
+    policy is a CompressionPolicy to choose the compression method of
+    each file which compress_type is not specified to write().
+    the archive can be a file object which can't be seeked, e.g. a pipe.
+    then the members are written with the data descriptors, and only
+    the ZipInfo of each member is kept for the central directory.
     """
+    zipinfo_cls = ZipInfoImproved
+
+    def __init__(self, *args, jobs=1, verbose=False, stats=None,
+                 dedup=False, policy=None, **kwargs):
+        self._pool = None
+        self.verbose = verbose
+        self.stats = stats
+        self.policy = policy
+        # set by write(), and used for the central directory.
+        self.filename_encoding = None
+        self.unicode_normalize = None
+        # the contents written, keyed by the size.
+        self._dedup = {} if dedup else None
+        self.dedup_stats = {"files": 0, "bytes": 0, "seconds": 0.0,
+                            "hashed_bytes": 0, "hash_seconds": 0.0}
+        super().__init__(*args, **kwargs)
+        if jobs > 1:
+            self._pool = ThreadPoolExecutor(max_workers=jobs)
+            self._pending = deque()
+            # limit the number of the members held in the temporary files.
+            self._max_pending = jobs * 2
+
     def write(self, filename, arcname=None,
               compress_type=None, compresslevel=None,
               filename_encoding=None, unicode_normalize=None,
-              debug=False):
+              debug=False, st=None):
         """Put the bytes from filename into the archive under the name
-        arcname."""
+        arcname.  st is the result of stat() of the filename if known."""
         if not self.fp:
             raise ValueError(
                 "Attempt to write to ZIP archive that was already closed")
@@ -44,9 +322,18 @@ class ZipFileImproved(ZipFile):
                 "Can't write to ZIP archive while an open writing handle exists"
             )
 
-        zinfo = zipfile.ZipInfo.from_file(filename, arcname)
+        if st is None:
+            zinfo = self.zipinfo_cls.from_file(filename, arcname)
+        else:
+            zinfo = zipinfo_from_stat(self.zipinfo_cls, filename, st, arcname)
         self.filename_encoding = filename_encoding
         self.unicode_normalize = unicode_normalize
+        # the local header has the same filename as the central directory.
+        flag_bits = zinfo.flag_bits
+        zinfo.flag_bits = 0
+        zinfo.encoded_name = (self._encodeFilenameFlags(zinfo),
+                              zinfo.flag_bits)
+        zinfo.flag_bits = flag_bits
 
         if zinfo.is_dir():
             zinfo.compress_size = 0
@@ -54,6 +341,9 @@ class ZipFileImproved(ZipFile):
         else:
             if compress_type is not None:
                 zinfo.compress_type = compress_type
+            elif self.policy is not None:
+                zinfo.compress_type = self.policy.choose(
+                        filename, zinfo.file_size, self.compression)
             else:
                 zinfo.compress_type = self.compression
 
@@ -62,27 +352,296 @@ class ZipFileImproved(ZipFile):
             else:
                 zinfo._compresslevel = self.compresslevel
 
-        if zinfo.is_dir():
+        entry = None
+        if self._dedup is not None and not zinfo.is_dir():
+            entry, duplicate = self._find_duplicate(filename, zinfo)
+            if duplicate:
+                if self._pool is None:
+                    self._write_duplicate(zinfo, entry)
+                else:
+                    # the original one may be still in the queue.
+                    self._pending.append((zinfo, None, entry))
+                return
+
+        if self._pool is not None and (self._seekable or
+                                       zinfo.file_size <= SPOOL_SIZE):
+            if zinfo.is_dir():
+                future = None
+            else:
+                future = self._pool.submit(self._compress_member,
+                                           filename, zinfo)
+            self._pending.append((zinfo, future, entry))
+            while len(self._pending) > self._max_pending:
+                self._write_pending()
+        elif zinfo.is_dir():
+            self._write_dir(zinfo)
+        else:
+            if self._pool is not None:
+                # a large member is not staged into a temporary file
+                # when the archive can't be seeked back.
+                while self._pending:
+                    self._write_pending()
+            t0 = perf_counter()
+            with open(filename, "rb") as src, self.open(zinfo, 'w') as dest:
+                shutil.copyfileobj(src, dest, 1024*8)
+            elapsed = perf_counter() - t0
+            if self.stats is not None:
+                self.stats.add_phase("compress", elapsed, zinfo.file_size)
+                self.stats.add_member(zinfo, filename, elapsed)
+            if entry is not None:
+                self._add_original(entry, elapsed)
+
+    def _find_duplicate(self, filename, zinfo):
+        """
+        return a tuple of _DedupEntry and whether zinfo is a duplicate of it.
+        if zinfo is a new content, a new entry is registered and returned.
+        a file is hashed only when another file of the same size has been
+        written.  an encrypted member can't be reused.
+        """
+        if (self.pwd is not None or self.encryption is not None or
+                not self._seekable):
+            return None, False
+        entries = self._dedup.setdefault(zinfo.file_size, [])
+        digest = None
+        if entries:
+            t0 = perf_counter()
+            digest = file_digest(filename)
+            nbytes = zinfo.file_size
+            found = None
+            for entry in entries:
+                if entry.digest is None:
+                    entry.digest = file_digest(entry.filename)
+                    nbytes += zinfo.file_size
+                if (entry.digest == digest and
+                        entry.zinfo.compress_type == zinfo.compress_type and
+                        entry.zinfo._compresslevel == zinfo._compresslevel):
+                    found = entry
+                    break
+            elapsed = perf_counter() - t0
+            self.dedup_stats["hashed_bytes"] += nbytes
+            self.dedup_stats["hash_seconds"] += elapsed
+            if self.stats is not None:
+                self.stats.add_phase("hash", elapsed, nbytes)
+            if found is not None:
+                return found, True
+        entry = _DedupEntry(filename, zinfo, digest)
+        entries.append(entry)
+        return entry, False
+
+    def _add_original(self, entry, elapsed):
+        # the compressed data is placed at the end of the member.
+        zinfo = entry.zinfo
+        if zinfo.flag_bits & 0x08:
+            # followed by a data descriptor.
+            self._dedup[zinfo.file_size].remove(entry)
+            return
+        entry.data_offset = self.start_dir - zinfo.compress_size
+        entry.elapsed = elapsed
+
+    def _write_duplicate(self, zinfo, entry):
+        """
+        write zinfo with the CRC, the sizes, and the compressed data of
+        entry written before.
+        """
+        if self.stats is not None:
+            t0 = perf_counter()
+        src = entry.zinfo
+        zinfo.CRC = src.CRC
+        zinfo.compress_size = src.compress_size
+        zinfo.compress_type = src.compress_type
+        zinfo.flag_bits = src.flag_bits
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16
+        zip64 = self._allowZip64 and zinfo.file_size * 1.05 > ZIP64_LIMIT
+        with self._lock:
+            self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.start_dir
+            self._writecheck(zinfo)
+            self._didModify = True
+            self.fp.write(zinfo.FileHeader(zip64))
+            read_pos = entry.data_offset
+            write_pos = self.fp.tell()
+            remain = src.compress_size
+            while remain > 0:
+                self.fp.seek(read_pos)
+                data = self.fp.read(min(remain, COPY_BUFSIZE))
+                if not data:
+                    raise zipfile.BadZipFile(
+                            f"Truncated member {src.filename}")
+                self.fp.seek(write_pos)
+                self.fp.write(data)
+                read_pos += len(data)
+                write_pos += len(data)
+                remain -= len(data)
+            self.start_dir = self.fp.tell()
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+        self.dedup_stats["files"] += 1
+        self.dedup_stats["bytes"] += zinfo.file_size
+        self.dedup_stats["seconds"] += entry.elapsed
+        if self.stats is not None:
+            self.stats.add_phase("dedup", perf_counter() - t0,
+                                 zinfo.compress_size)
+
+    def _write_dir(self, zinfo):
+        with self._lock:
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.fp.tell()  # Start of header bytes
+            if zinfo.compress_type == ZIP_LZMA:
+            # Compressed data includes an end-of-stream (EOS) marker
+                zinfo.flag_bits |= 0x02
+
+            self._writecheck(zinfo)
+            self._didModify = True
+
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+            self.fp.write(zinfo.FileHeader(False))
+            self.start_dir = self.fp.tell()
+
+    def _compress_member(self, filename, zinfo):
+        """
+        compress, and encrypt if needed, the contents of filename
+        into a temporary file.  it is called by a worker, and doesn't
+        touch self.fp.  see _open_to_write() for the flags.
+        """
+        zinfo.compress_size = 0
+        zinfo.CRC = 0
+        zinfo.flag_bits = 0x00
+        encrypter = None
+        if self.pwd is not None or self.encryption is not None:
+            encrypter = self.get_encrypter()
+            if encrypter is None:
+                # never mark a member encrypted without encrypting it.
+                raise ZipxError("the encryption is not set.  "
+                                "see set_password().")
+            zinfo.flag_bits |= 0x01
+            encrypter.update_zipinfo(zinfo)
+        if zinfo.compress_type == ZIP_LZMA:
+            # Compressed data includes an end-of-stream (EOS) marker
+            zinfo.flag_bits |= 0x02
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16
+        zip64 = self._allowZip64 and zinfo.file_size * 1.05 > ZIP64_LIMIT
+        zinfo.header_offset = 0
+        t0 = perf_counter()
+        staged = _StagedMember()
+        try:
+            with open(filename, "rb") as src, \
+                 self.zipwritefile_cls(staged, zinfo, zip64,
+                                       encrypter) as dest:
+                shutil.copyfileobj(src, dest, COPY_BUFSIZE)
+        except:
+            staged.fp.close()
+            raise
+        elapsed = perf_counter() - t0
+        if self.stats is not None:
+            self.stats.add_phase("compress", elapsed, zinfo.file_size)
+            self.stats.add_member(zinfo, filename, elapsed)
+        return staged.fp, elapsed
+
+    def _write_pending(self):
+        """
+        append the oldest member in the queue into the archive.
+        the local header and the data have been made by a worker.
+        """
+        zinfo, future, entry = self._pending.popleft()
+        if future is None:
+            if entry is not None:
+                self._write_duplicate(zinfo, entry)
+            else:
+                self._write_dir(zinfo)
+            return
+        staged_fp, elapsed = future.result()
+        if self.stats is not None:
+            t0 = perf_counter()
+        try:
             with self._lock:
                 if self._seekable:
                     self.fp.seek(self.start_dir)
-                zinfo.header_offset = self.fp.tell()  # Start of header bytes
-                if zinfo.compress_type == ZIP_LZMA:
-                # Compressed data includes an end-of-stream (EOS) marker
-                    zinfo.flag_bits |= 0x02
-
+                zinfo.header_offset = self.fp.tell()
                 self._writecheck(zinfo)
                 self._didModify = True
-
+                staged_fp.seek(0)
+                shutil.copyfileobj(staged_fp, self.fp, COPY_BUFSIZE)
+                self.start_dir = self.fp.tell()
                 self.filelist.append(zinfo)
                 self.NameToInfo[zinfo.filename] = zinfo
-                self.fp.write(zinfo.FileHeader(False))
-                self.start_dir = self.fp.tell()
-        else:
-            with open(filename, "rb") as src, self.open(zinfo, 'w') as dest:
-                shutil.copyfileobj(src, dest, 1024*8)
+        finally:
+            staged_fp.close()
+        if self.stats is not None:
+            self.stats.add_phase("write", perf_counter() - t0,
+                                 zinfo.compress_size)
+        if entry is not None:
+            self._add_original(entry, elapsed)
+
+    def copy_member_from(self, src, zinfo, end):
+        """
+        copy the local header and the data of zinfo in src, another
+        ZipFile, verbatim up to end, which is the offset of the next record,
+        without recompressing.
+        """
+        if self._pool is not None:
+            while self._pending:
+                self._write_pending()
+        with self._lock:
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            header_offset = self.fp.tell()
+            self._writecheck(zinfo)
+            self._didModify = True
+            src.fp.seek(zinfo.header_offset)
+            remain = end - zinfo.header_offset
+            while remain > 0:
+                data = src.fp.read(min(remain, COPY_BUFSIZE))
+                if not data:
+                    raise zipfile.BadZipFile(
+                            f"Truncated file {zinfo.filename}")
+                self.fp.write(data)
+                remain -= len(data)
+            zinfo.header_offset = header_offset
+            self.start_dir = self.fp.tell()
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+
+    def close(self):
+        if self._pool is not None:
+            try:
+                while self._pending:
+                    self._write_pending()
+            finally:
+                # discard the members remained if an error happened.
+                for _, future, _ in self._pending:
+                    if future is not None:
+                        future.cancel()
+                self._pool.shutdown()
+                self._pool = None
+        if (self.verbose and self.dedup_stats["files"] and
+                self.fp is not None):
+            x = self.dedup_stats
+            print(f"dedup: {x['files']} files, {x['bytes']} bytes not "
+                  f"compressed again, {x['seconds']:.3f} sec saved, "
+                  f"{x['hashed_bytes']} bytes hashed in "
+                  f"{x['hash_seconds']:.3f} sec.")
+        if self.verbose and self.policy is not None and self.fp is not None:
+            counts = ", ".join(f"{n} {compression_names.get(k, k)}"
+                               for k, n in sorted(self.policy.counts.items()))
+            if counts:
+                print(f"compression: {counts}.")
+        if self.stats is None or self.fp is None:
+            super().close()
+            return
+        # the central directory is written.
+        t0 = perf_counter()
+        super().close()
+        self.stats.add_phase("close", perf_counter() - t0)
 
     def _write_end_record(self):
+        # the records are built in a buffer, and written in large chunks.
+        buf = bytearray()
+        progress = ProgressReporter("zipped", len(self.filelist),
+                                    self.verbose)
         for zinfo in self.filelist:         # write central directory
             dt = zinfo.date_time
             dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
@@ -115,6 +674,16 @@ class ZipFileImproved(ZipFile):
 
                 min_version = ZIP64_VERSION
 
+            crc = zinfo.CRC
+            compress_type = zinfo.compress_type
+            if getattr(zinfo, "wz_aes_vendor_id", None) is not None:
+                # an AES encrypted member has the method 99 and
+                # the AES extra field, which replaces the one read.
+                aes_extra, crc, compress_type = zinfo.encode_extra(
+                        crc, compress_type)
+                extra_data = _strip_extra(extra_data,
+                                          (EXTRA_WZ_AES,)) + aes_extra
+
             if zinfo.compress_type == ZIP_BZIP2:
                 min_version = max(BZIP2_VERSION, min_version)
             elif zinfo.compress_type == ZIP_LZMA:
@@ -125,15 +694,14 @@ class ZipFileImproved(ZipFile):
             try:
                 # no need, converted before.
                 filename = self._encodeFilenameFlags(zinfo)
-                centdir = struct.pack(structCentralDir,
-                                      stringCentralDir, create_version,
-                                      zinfo.create_system, extract_version, zinfo.reserved,
-                                      zinfo.flag_bits, zinfo.compress_type, dostime, dosdate,
-                                      zinfo.CRC, compress_size, file_size,
-                                      len(filename), len(extra_data), len(zinfo.comment),
-                                      0, zinfo.internal_attr, zinfo.external_attr,
-                                      header_offset)
-                print(f"zipped: {zinfo.filename}")
+                centdir = packCentralDir(
+                        stringCentralDir, create_version,
+                        zinfo.create_system, extract_version, zinfo.reserved,
+                        zinfo.flag_bits, compress_type, dostime, dosdate,
+                        crc, compress_size, file_size,
+                        len(filename), len(extra_data), len(zinfo.comment),
+                        0, zinfo.internal_attr, zinfo.external_attr,
+                        header_offset)
             except DeprecationWarning:
                 print((structCentralDir, stringCentralDir, create_version,
                        zinfo.create_system, extract_version, zinfo.reserved,
@@ -143,10 +711,16 @@ class ZipFileImproved(ZipFile):
                        0, zinfo.internal_attr, zinfo.external_attr,
                        header_offset), file=sys.stderr)
                 raise
-            self.fp.write(centdir)
-            self.fp.write(filename)
-            self.fp.write(extra_data)
-            self.fp.write(zinfo.comment)
+            buf += centdir
+            buf += filename
+            buf += extra_data
+            buf += zinfo.comment
+            if len(buf) >= CENTDIR_BUFSIZE:
+                self.fp.write(buf)
+                buf = bytearray()
+            progress.update(zinfo.filename)
+        self.fp.write(buf)
+        progress.done()
 
         pos2 = self.fp.tell()
         # Write end-of-zip-archive record
@@ -212,60 +786,537 @@ class ZipFileImproved(ZipFile):
                     or utf-8, but {self.filename_encoding}""")
         return filename_zipped
 
-def walkdir(filename, zfd):
-    # check if the file is a directory or not.
-    mode = stat(filename).st_mode
-    if not S_ISDIR(mode):
-        zfd.write(filename, filename_encoding=opt.filename_encoding,
-                  unicode_normalize=opt.unicode_normalize)
+def restore_filenames(z, filename_encoding):
+    """
+    zipfile.py decodes a filename without the utf-8 bit in cp437.
+    decode it again in filename_encoding so that the names of the members
+    read from the zip file are written back as they were.
+    """
+    if filename_encoding is None:
         return
+    for zinfo in z.filelist:
+        if not zinfo.flag_bits & 0x800:
+            try:
+                zinfo.filename = zinfo.filename.encode("cp437").decode(
+                        filename_encoding)
+            except UnicodeError:
+                pass
+    z.NameToInfo = {zinfo.filename: zinfo for zinfo in z.filelist}
+
+def arcname_key(filename, unicode_normalize):
+    # the name in the zip file, see ZipInfo.from_file().
+    arcname = normpath(splitdrive(filename)[1])
+    while arcname[0] in (sep, altsep):
+        arcname = arcname[1:]
+    if unicode_normalize:
+        arcname = unicodedata.normalize(unicode_normalize, arcname)
+    return arcname
+
+def file_crc(filename):
+    crc = 0
+    with open(filename, "rb") as fd:
+        while True:
+            data = fd.read(COPY_BUFSIZE)
+            if not data:
+                return crc
+            crc = crc32(data, crc)
+
+def is_unchanged(zinfo, filename, st, check_crc):
+    """
+    compare the file with the member by the size and the mtime in the
+    resolution of the zip file (2 seconds), and the CRC if check_crc.
+    """
+    if zinfo.file_size != st.st_size:
+        return False
+    date_time = localtime(st.st_mtime)[0:6]
+    date_time = date_time[:5] + (date_time[5] // 2 * 2,)
+    if tuple(zinfo.date_time) != date_time:
+        return False
+    if check_crc:
+        return file_crc(filename) == zinfo.CRC
+    return True
+
+class ZipxError(Exception):
+    pass
+
+def set_password(z, password):
+    # pyzipper encrypts the members only when the encryption is set.
+    z.setpassword(bytes(password, "ascii"))
+    z.setencryption(zipfile.WZ_AES)
 
-    # file is a directory
-    with scandir(filename) as fd:
-        for entry in fd:
-            #print("ent: {:s}/{:s}".format(filename, entry.name))
+class CreateResult:
+    """
+    the numbers of the files added, changed, removed, and unchanged.
+    in the update mode, changed and removed are the members replaced
+    and removed, and unchanged are the members kept as they are.
+    dedup is ZipFileImproved.dedup_stats if dedup is enabled.
+    """
+    def __init__(self):
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.unchanged = 0
+        self.dedup = None
+
+def update_zip_file(zip_file, walker, roots, password=None,
+                    filename_encoding="cp932", unicode_normalize=None,
+                    freshen=False, check_crc=False, sync=False, jobs=1,
+                    verbose=False, stats=None, dedup=False,
+                    compression=zipfile.ZIP_STORED, compresslevel=None,
+                    policy=None):
+    """
+    add the files newer than the members in the zip file.
+    if a member is changed or removed, the zip file is compacted.
+    the members not changed are copied without recompressing them.
+    roots are the files specified to decide the members removed by sync.
+    """
+    result = CreateResult()
+    with ZipFile(zip_file) as old:
+        restore_filenames(old, filename_encoding)
+        members = {}
+        for zinfo in old.infolist():
+            if unicode_normalize:
+                key = unicodedata.normalize(unicode_normalize,
+                                            zinfo.filename)
+            else:
+                key = zinfo.filename
+            members[key] = zinfo
+        added = []
+        changed = []
+        seen = set()
+        for filename, st in walker:
+            key = arcname_key(filename, unicode_normalize)
+            zinfo = members.get(key)
+            if zinfo is None:
+                if not freshen:
+                    added.append((filename, st))
+                continue
+            seen.add(key)
+            if is_unchanged(zinfo, filename, st, check_crc):
+                result.unchanged += 1
+            else:
+                changed.append((filename, st))
+        removed = set()
+        if sync:
+            roots = [arcname_key(x, unicode_normalize).rstrip("/")
+                     for x in roots]
+            for key in members:
+                if key in seen:
+                    continue
+                for root in roots:
+                    # "." is the current directory, having all the members.
+                    if (root == "." or key == root
+                            or key.startswith(root + "/")):
+                        removed.add(key)
+                        break
+        result.added = len(added)
+        result.changed = len(changed)
+        result.removed = len(removed)
+        if verbose:
+            print(f"update: {len(changed)} changed, {len(added)} added, "
+                  f"{len(removed)} removed, {result.unchanged} unchanged.")
+        if not changed and not removed:
+            if not added:
+                return result
+            old.close()
+            with ZipFileImproved(zip_file, "a", compression=compression,
+                                 compresslevel=compresslevel, jobs=jobs,
+                                 verbose=verbose, stats=stats, dedup=dedup,
+                                 policy=policy) as z:
+                if password:
+                    set_password(z, password)
+                restore_filenames(z, filename_encoding)
+                for filename, st in added:
+                    z.write(filename, filename_encoding=filename_encoding,
+                            unicode_normalize=unicode_normalize, st=st)
+            if dedup:
+                result.dedup = z.dedup_stats
+            return result
+        # compact the zip file.
+        skipped = removed.union([arcname_key(x[0], unicode_normalize)
+                                 for x in changed])
+        offsets = sorted([zinfo.header_offset for zinfo in old.infolist()])
+        offsets.append(old.start_dir)
+        ends = dict(zip(offsets, offsets[1:]))
+        tmp_file = fspath(zip_file) + ".tmp"
+        try:
+            with ZipFileImproved(tmp_file, "w", compression=compression,
+                                 compresslevel=compresslevel, jobs=jobs,
+                                 verbose=verbose, stats=stats, dedup=dedup,
+                                 policy=policy) as z:
+                if password:
+                    set_password(z, password)
+                # the members copied are written in the central directory
+                # even if no file is written.
+                z.filename_encoding = filename_encoding
+                z.unicode_normalize = unicode_normalize
+                for key, zinfo in members.items():
+                    if key in skipped:
+                        continue
+                    z.copy_member_from(old, zinfo, ends[zinfo.header_offset])
+                for filename, st in changed + added:
+                    z.write(filename, filename_encoding=filename_encoding,
+                            unicode_normalize=unicode_normalize, st=st)
+            if dedup:
+                result.dedup = z.dedup_stats
+        except:
+            unlink(tmp_file)
+            raise
+    replace(tmp_file, zip_file)
+    return result
+
+def match_patterns(path, patterns):
+    """
+    a pattern including a slash is matched with the path,
+    otherwise it is matched with the basename of the path.
+    """
+    name = basename(path)
+    for x in patterns:
+        if fnmatch(path if "/" in x else name, x):
+            return True
+    return False
+
+def is_target_path(path, include, exclude):
+    if exclude and match_patterns(path, exclude):
+        return False
+    if include and not match_patterns(path, include):
+        return False
+    return True
+
+def scan_entries(dirname):
+    # close the directory as soon as possible.
+    with scandir(dirname) as fd:
+        return list(fd)
+
+def walkdir(filenames, include=None, exclude=None,
+            follow_symlinks=False, one_file_system=False):
+    """
+    generate a tuple of the path and the result of stat() of each file
+    under filenames in the depth-first order, without any recursive call.
+    the result of stat() cached in DirEntry is reused.
+    the directories excluded are not traversed.  a symbolic link to
+    a directory is traversed only if follow_symlinks is True.
+    """
+    for filename in filenames:
+        # check if the file is a directory or not.
+        st = stat(filename)
+        if not S_ISDIR(st.st_mode):
+            if is_target_path(filename, include, exclude):
+                yield filename, st
+            continue
+        # file is a directory
+        top_dev = st.st_dev
+        visited = {(st.st_dev, st.st_ino)}
+        stack = [iter(scan_entries(filename))]
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop()
+                continue
             if entry.name.startswith(".."):
                 continue
-            walkdir(entry.path, zfd)
-
-ap = ArgumentParser(
-        description="zip and compress the files named a utf-8 filename.",
-        formatter_class=ArgumentDefaultsHelpFormatter)
-ap.add_argument("zip_file", help="specify a zip file.")
-ap.add_argument("files", nargs="+", help="specify files to be zipped.")
-ap.add_argument("-p", "--password", action="store", dest="password",
-                help="specify the password for the zipped file.")
-ap.add_argument("-e", "--encoding", action="store", dest="filename_encoding",
-                default="cp932",
-                help="specify a filename encoding.  e.g. cp932, utf-8.")
-ap.add_argument("-C", action="store_false", dest="enable_conversion",
-                help="disable to convert the filename.")
-ap.add_argument("-n", "--normalize", action="store", dest="unicode_normalize",
-                help=f"""specify a string for normalization of the filename.
-                valid string are {valid_unicode_normalize_options}""")
-ap.add_argument("-F", action="store_true", dest="overwrite",
-                help="specity to overwrite the zip file even if exists.")
-ap.add_argument("-q", "--quiet", action="store_false", dest="verbose",
-                help="enable quiet mode.")
-ap.add_argument("-d", action="store_true", dest="debug",
-                help="enable debug mode.")
-opt = ap.parse_args()
-
-# filename encoding
-if opt.enable_conversion is False:
-    opt.filename_encoding = None
-
-extract_file_list = None
-
-# check if the file exists.
-if exists(opt.zip_file) and not opt.overwrite:
-    zip_mode = "a"
-else:
-    zip_mode = "w"
-
-with ZipFileImproved(opt.zip_file, zip_mode) as z:
-    if opt.password:
-        z.setpassword(bytes(opt.password, "ascii"))
-    for filename in opt.files:
-        walkdir(filename, z)
+            if exclude and match_patterns(entry.path, exclude):
+                continue
+            if entry.is_dir():
+                if entry.is_symlink():
+                    if not follow_symlinks:
+                        continue
+                    # avoid a loop made by the symbolic links.
+                    st = entry.stat()
+                    if (st.st_dev, st.st_ino) in visited:
+                        continue
+                    visited.add((st.st_dev, st.st_ino))
+                    if one_file_system and st.st_dev != top_dev:
+                        continue
+                elif follow_symlinks or one_file_system:
+                    st = entry.stat(follow_symlinks=False)
+                    if one_file_system and st.st_dev != top_dev:
+                        continue
+                    # a link to this directory is not traversed again.
+                    visited.add((st.st_dev, st.st_ino))
+                stack.append(iter(scan_entries(entry.path)))
+                continue
+            if include and not match_patterns(entry.path, include):
+                continue
+            yield entry.path, entry.stat()
+
+def walk_in_background(walker, queue_size):
+    """
+    run walker in another thread so that the traversal of the directories
+    overlaps with the compression.  at most queue_size files are held.
+    the thread is stopped and joined when the generator is closed before
+    the end, e.g. by an error while zipping the files.
+    """
+    queue = Queue(maxsize=queue_size)
+    stop = Event()
+
+    def put(x):
+        # give up when the consumer has gone.
+        while not stop.is_set():
+            try:
+                queue.put(x, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for x in walker:
+                if not put(x):
+                    return
+        except BaseException as e:
+            put(e)
+        else:
+            put(None)
+
+    thread = Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            x = queue.get()
+            if x is None:
+                break
+            if isinstance(x, BaseException):
+                raise x
+            yield x
+    finally:
+        stop.set()
+        thread.join()
+
+def create(zip_file, files, password=None, filename_encoding="cp932",
+           unicode_normalize=None, include=(), exclude=(),
+           follow_symlinks=False, one_file_system=False, queue_size=1024,
+           overwrite=False, update=False, freshen=False, check_crc=False,
+           sync=False, jobs=1, verbose=False, stats=None, dedup=False,
+           compression=zipfile.ZIP_STORED, compresslevel=None, policy=None):
+    """
+    zip files into zip_file, and return CreateResult.
+    the files are appended if zip_file exists and overwrite is False.
+    zip_file can be a file object opened to write, e.g. the standard
+    output, to stream the zip file.
+    filename_encoding is the encoding of the filenames, or None not to
+    convert them.  stats is a Stats to take the time of each phase.
+    if dedup, the files of the same content are compressed only once.
+    compression and compresslevel are the method and the level of
+    the archive.  policy is a CompressionPolicy to choose the method of
+    each file instead.
+    """
+    if jobs < 1:
+        raise ZipxError("the number of jobs must be a positive number.")
+    if (update or freshen) and overwrite:
+        raise ZipxError("overwrite can't be used in the update mode.")
+
+    # check if the file exists.
+    if not isinstance(zip_file, (str, PathLike)):
+        if update or freshen:
+            raise ZipxError("a file object can't be updated.")
+        zip_mode = "w"
+    elif exists(zip_file) and not overwrite:
+        zip_mode = "a"
+    else:
+        zip_mode = "w"
+    if freshen and zip_mode == "w":
+        # freshen adds no file, so nothing is done without the zip file.
+        if verbose:
+            print(f"freshen: {zip_file} doesn't exist, nothing to do.")
+        return CreateResult()
+
+    walker = walkdir(files, include=include, exclude=exclude,
+                     follow_symlinks=follow_symlinks,
+                     one_file_system=one_file_system)
+    background = walk_in_background(walker, queue_size)
+    walker = background
+    if stats is not None:
+        walker = timed_walk(walker, stats)
+    try:
+        if zip_mode == "a" and (update or freshen):
+            return update_zip_file(
+                    zip_file, walker, files,
+                    password=password, filename_encoding=filename_encoding,
+                    unicode_normalize=unicode_normalize, freshen=freshen,
+                    check_crc=check_crc, sync=sync, jobs=jobs, verbose=verbose,
+                    stats=stats, dedup=dedup, compression=compression,
+                    compresslevel=compresslevel, policy=policy)
+
+        result = CreateResult()
+        with ZipFileImproved(zip_file, zip_mode, compression=compression,
+                             compresslevel=compresslevel, jobs=jobs,
+                             verbose=verbose, stats=stats, dedup=dedup,
+                             policy=policy) as z:
+            if password:
+                set_password(z, password)
+            if zip_mode == "a":
+                restore_filenames(z, filename_encoding)
+            for filename, st in walker:
+                z.write(filename, filename_encoding=filename_encoding,
+                        unicode_normalize=unicode_normalize, st=st)
+                result.added += 1
+        if dedup:
+            result.dedup = z.dedup_stats
+        return result
+    finally:
+        # stop the thread walking the directories if zipping failed.
+        background.close()
+
+def main(argv=None):
+    ap = ArgumentParser(
+            description="zip and compress the files named a utf-8 filename.",
+            formatter_class=ArgumentDefaultsHelpFormatter)
+    ap.add_argument("zip_file",
+                    help="""specify a zip file.  "-" means the standard
+                    output, and the messages are printed to the standard
+                    error.""")
+    ap.add_argument("files", nargs="+", help="specify files to be zipped.")
+    ap.add_argument("-p", "--password", action="store", dest="password",
+                    help="specify the password for the zipped file.")
+    ap.add_argument("-e", "--encoding", action="store", dest="filename_encoding",
+                    default="cp932",
+                    help="specify a filename encoding.  e.g. cp932, utf-8.")
+    ap.add_argument("-C", action="store_false", dest="enable_conversion",
+                    help="disable to convert the filename.")
+    ap.add_argument("-n", "--normalize", action="store", dest="unicode_normalize",
+                    help=f"""specify a string for normalization of the filename.
+                    valid string are {valid_unicode_normalize_options}""")
+    ap.add_argument("-i", "--include", action="append", dest="include",
+                    default=[],
+                    help="""specify a glob pattern of the files to be zipped.
+                    a pattern without a slash is matched with the basename.
+                    This option can be specified in multiple.""")
+    ap.add_argument("-x", "--exclude", action="append", dest="exclude",
+                    default=[],
+                    help="""specify a glob pattern of the files and
+                    the directories to be ignored.
+                    This option can be specified in multiple.""")
+    ap.add_argument("--follow-symlinks", action="store_true",
+                    dest="follow_symlinks",
+                    help="traverse a symbolic link to a directory.")
+    ap.add_argument("--one-file-system", action="store_true",
+                    dest="one_file_system",
+                    help="don't traverse a directory on other file systems.")
+    ap.add_argument("--queue-size", action="store", dest="queue_size",
+                    type=int, default=1024,
+                    help="specify the number of the files queued to be zipped.")
+    ap.add_argument("-u", "--update", action="store_true", dest="update",
+                    help="""add only the files newer than the members in
+                    the zip file, or not in the zip file.""")
+    ap.add_argument("-f", "--freshen", action="store_true", dest="freshen",
+                    help="""replace only the members older than the files.
+                    no new file is added.""")
+    ap.add_argument("--check-crc", action="store_true", dest="check_crc",
+                    help="compare the CRC as well in the update mode.")
+    ap.add_argument("--sync", action="store_true", dest="sync",
+                    help="""remove the members of which file doesn't exist
+                    in the update mode.""")
+    ap.add_argument("-F", action="store_true", dest="overwrite",
+                    help="specity to overwrite the zip file even if exists.")
+    ap.add_argument("-j", "--jobs", action="store", dest="jobs",
+                    type=int, default=1,
+                    help="specify the number of workers to compress the files.")
+    ap.add_argument("-Z", "--compression", action="store",
+                    dest="compression", default="stored",
+                    choices=list(compression_methods),
+                    help="specify the compression method.")
+    ap.add_argument("-l", "--level", action="store", dest="compresslevel",
+                    type=int,
+                    help="specify the compression level.")
+    ap.add_argument("--adaptive", action="store_true", dest="adaptive",
+                    help="""store the files which don't shrink, chosen by
+                    the extension and a trial compression of the first
+                    block, and compress the others by the method specified
+                    by -Z.""")
+    ap.add_argument("--policy", action="store", dest="policy_file",
+                    help="""specify a file of the rules to choose the
+                    compression method, a pattern and one of stored,
+                    deflate, bzip2, lzma, default, or auto in a line.
+                    it implies --adaptive.""")
+    ap.add_argument("--dedup", action="store_true", dest="dedup",
+                    help="""compress the files of the same content only once,
+                    and copy the compressed data for the others.
+                    it is ignored if a password is specified.""")
+    ap.add_argument("--stats", action="store_true", dest="stats",
+                    help="""show the time of each phase, the throughput of
+                    each compression method, and the slowest files.""")
+    ap.add_argument("--stats-json", action="store", dest="stats_json",
+                    help="""specify a file to write the stats in JSON.
+                    "-" means the standard output.""")
+    ap.add_argument("--stats-top", action="store", dest="stats_top",
+                    type=int, default=10,
+                    help="specify the number of the slowest files shown.")
+    ap.add_argument("--profile", action="store", dest="profile",
+                    help="""specify a file to write the profile taken by
+                    cProfile.""")
+    ap.add_argument("-q", "--quiet", action="store_false", dest="verbose",
+                    help="enable quiet mode.")
+    ap.add_argument("-d", action="store_true", dest="debug",
+                    help="enable debug mode.")
+    opt = ap.parse_args(argv)
+
+    if opt.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run, opt)
+        finally:
+            profiler.dump_stats(opt.profile)
+    return run(opt)
+
+def run(opt):
+    """
+    zip the files as opt, the command line parsed, specifies.
+    return the exit status.
+    """
+    # filename encoding
+    if opt.enable_conversion is False:
+        opt.filename_encoding = None
+
+    if (opt.update or opt.freshen) and opt.overwrite:
+        print("ERROR: the -F option can't be used in the update mode.")
+        return 1
+
+    stats = None
+    if opt.stats or opt.stats_json:
+        stats = Stats(opt.stats_top)
+
+    output = opt.zip_file
+    messages = nullcontext()
+    if opt.zip_file == "-":
+        if opt.update or opt.freshen:
+            print("ERROR: the standard output can't be updated.")
+            return 1
+        output = sys.stdout.buffer
+        # the messages must not be mixed with the zip file.
+        messages = redirect_stdout(sys.stderr)
+
+    status = 0
+    with messages:
+        try:
+            policy = None
+            if opt.policy_file:
+                policy = CompressionPolicy.load(opt.policy_file)
+            elif opt.adaptive:
+                policy = CompressionPolicy()
+            create(output, opt.files, password=opt.password,
+                   filename_encoding=opt.filename_encoding,
+                   unicode_normalize=opt.unicode_normalize,
+                   include=opt.include, exclude=opt.exclude,
+                   follow_symlinks=opt.follow_symlinks,
+                   one_file_system=opt.one_file_system,
+                   queue_size=opt.queue_size, overwrite=opt.overwrite,
+                   update=opt.update, freshen=opt.freshen,
+                   check_crc=opt.check_crc, sync=opt.sync, jobs=opt.jobs,
+                   verbose=opt.verbose, stats=stats, dedup=opt.dedup,
+                   compression=compression_methods[opt.compression],
+                   compresslevel=opt.compresslevel, policy=policy)
+        except ZipxError as e:
+            print(f"ERROR: {e}")
+            status = 1
+
+        if opt.stats:
+            stats.print_report()
+        if opt.stats_json:
+            stats.write_json(opt.stats_json)
+    return status
 
+if __name__ == "__main__":
+    sys.exit(main())